@@ -0,0 +1,38 @@
+import os
+import time
+
+from clu_emulator.cipher import CluCipher
+
+# Encrypt and decrypt ops/sec of CluCipher for 64-1024 byte payloads, one
+# call per payload and in batches of 64 through encrypt_many/decrypt_many.
+#
+#   python -m benchmarks.cipher_batch
+
+OPERATIONS = 50000
+BATCH_SIZE = 64
+PAYLOAD_SIZES = (64, 128, 256, 512, 1024)
+
+
+def ops_per_second(function, argument, operations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(operations):
+        function(argument)
+    return operations / (time.perf_counter() - start)
+
+def main() -> None:
+    cipher = CluCipher(os.urandom(16), os.urandom(16))
+    
+    print(f"{'size':>5s} {'encrypt':>10s} {'decrypt':>10s} {'encrypt_many':>13s} {'decrypt_many':>13s}  [ops/s]")
+    for size in PAYLOAD_SIZES:
+        data = os.urandom(size)
+        encrypted = cipher.encrypt(data)
+        
+        encrypt = ops_per_second(cipher.encrypt, data, OPERATIONS)
+        decrypt = ops_per_second(cipher.decrypt, encrypted, OPERATIONS)
+        encrypt_many = ops_per_second(cipher.encrypt_many, [data] * BATCH_SIZE, OPERATIONS // BATCH_SIZE) * BATCH_SIZE
+        decrypt_many = ops_per_second(cipher.decrypt_many, [encrypted] * BATCH_SIZE, OPERATIONS // BATCH_SIZE) * BATCH_SIZE
+        
+        print(f"{size:5d} {encrypt:10.0f} {decrypt:10.0f} {encrypt_many:13.0f} {decrypt_many:13.0f}")
+
+if __name__ == "__main__":
+    main()
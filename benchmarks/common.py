@@ -0,0 +1,24 @@
+import os
+
+from clu_emulator.cipher import CluCipher
+from clu_emulator.client_manager import ClientManager
+from clu_emulator.clu_lua_engine import CluLuaEngine
+from clu_emulator.config import Config
+
+# Helpers shared by the benchmark scripts. The scripts are run from the
+# repository root as modules, e.g. "python -m benchmarks.cipher_batch".
+
+
+def make_config(**kwargs) -> Config:
+    return Config(1, "00:00:00:00:00:00", "12345678", "", "", **kwargs)
+
+def write_lua_config(config_dir: str, om: str, user: str = "") -> None:
+    with open(os.path.join(config_dir, "om.lua"), "w") as file:
+        file.write(om)
+    
+    with open(os.path.join(config_dir, "user.lua"), "w") as file:
+        file.write(user)
+
+def make_engine(config_dir: str, **kwargs) -> CluLuaEngine:
+    cipher = CluCipher(bytes(16), bytes(16))
+    return CluLuaEngine(make_config(**kwargs), ClientManager(cipher, None, "127.0.0.1"), cipher, config_dir)
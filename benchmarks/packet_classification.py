@@ -0,0 +1,59 @@
+import base64
+import contextlib
+import io
+import logging
+import os
+import time
+
+from clu_emulator.cipher import CluCipher
+from clu_emulator.clu_server import CluServer
+from clu_emulator.commands.simple_handler_command import SimpleHandlerCommand
+from clu_emulator.utils import key_derivation
+
+from .common import make_config
+
+# Packets per second through CluServer._handle_packet for every packet type:
+# lua requests and commands (project key), discovery (grenton key), clu ip
+# change (private key) and packets no key decrypts. Replies are not sent.
+#
+#   python -m benchmarks.packet_classification
+
+PACKETS = 20000
+REPEATS = 5
+
+
+def main() -> None:
+    logging.disable(logging.CRITICAL)
+    
+    config = make_config()
+    project_key, project_iv = os.urandom(16), os.urandom(16)
+    server = CluServer(config, project_key, project_iv, "/tmp", "127.0.0.1")
+    server.set_lua_request_handler(lambda context, payload: "values:{1}")
+    server.register_command(SimpleHandlerCommand("req_noop", lambda *args: None, "resp:OK"))
+    server._send = lambda data, addr: None
+    
+    project = CluCipher(project_key, project_iv)
+    private = CluCipher(key_derivation(config.private_key.encode()), base64.b64decode(config.clu_iv))
+    packets = {
+        "lua request": project.encrypt(b"req:192.168.1.2:1a2b3c4d:SYSTEM:fetchValues({{CLU,0}})"),
+        "command": project.encrypt(b"req_noop\r\n"),
+        "discovery": server.grenton_cipher.encrypt(os.urandom(32) + b":" + os.urandom(16) + b":req_discovery_clu:192.168.1.2"),
+        "set clu ip": private.encrypt(b"req_set_clu_ip:192.168.1.3"),
+        "unknown": os.urandom(96),
+    }
+    
+    addr = ("127.0.0.1", 5000)
+    for name, packet in packets.items():
+        best = float("inf")
+        for _ in range(REPEATS):
+            # Handlers print every packet.
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                for _ in range(PACKETS):
+                    server._handle_packet(packet, addr)
+                best = min(best, time.perf_counter() - start)
+        
+        print(f"{name:12s} {PACKETS / best:9.0f} packets/s  {best / PACKETS * 1e6:6.2f} us/packet")
+
+if __name__ == "__main__":
+    main()
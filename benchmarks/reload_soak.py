@@ -0,0 +1,96 @@
+import gc
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from clu_emulator.objects.timer_object import TimerObject
+
+from .common import make_engine, write_lua_config
+
+# Reloads a configuration with 20 running cyclic timers 1000 times and checks
+# that reloading does not leak memory, threads, timers or objects. Exits with
+# status 1 if the RSS or the thread count keeps growing.
+#
+#   python -m benchmarks.reload_soak
+
+RELOADS = 1000
+WARMUP = 100
+TIMERS = 20
+PERIOD_MS = 50
+# Allowed RSS growth between the end of the warmup and the last reload.
+RSS_SLACK_MIB = 8
+
+# The timers are set up from python, as lupa does not reliably tell a
+# method call with an explicit self argument from one without.
+OM = f"""CLU = GATE:new()
+T = {{}}
+for i = 1, {TIMERS} do T[i] = OBJECT:new(6, i) end
+counter = 0
+function count() counter = counter + 1 end
+"""
+
+
+def rss() -> float:
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+def start_timers(engine) -> None:
+    with engine.request_lock:
+        lua = engine.lua.globals()
+        for i in range(1, TIMERS + 1):
+            timer = lua.T[i]
+            timer.set(0, PERIOD_MS)
+            timer.set(1, 1)
+            timer.add_event(0, lua.count)
+            timer.start()
+
+def main() -> int:
+    logging.disable(logging.CRITICAL)
+    
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_lua_config(config_dir, OM)
+        engine = make_engine(config_dir)
+        start_timers(engine)
+        time.sleep(0.5)
+        threads = threading.active_count()
+        
+        samples = []
+        start = time.perf_counter()
+        for i in range(RELOADS):
+            engine.reload()
+            start_timers(engine)
+            if (i + 1) % (RELOADS // 10) == 0 or i + 1 == WARMUP:
+                gc.collect()
+                samples.append((i + 1, rss()))
+        elapsed = time.perf_counter() - start
+        
+        time.sleep(0.5)
+        gc.collect()
+        warm = dict(samples)[WARMUP]
+        final = rss()
+        final_threads = threading.active_count()
+        pending = engine.scheduler.pending()
+        live = sum(1 for obj in gc.get_objects() if type(obj) is TimerObject)
+        engine.close()
+    
+    print(f"{RELOADS} reloads: {elapsed / RELOADS * 1000:.2f} ms/reload")
+    print("RSS MiB: " + ", ".join(f"{count}: {size:.1f}" for count, size in samples) + f", end: {final:.1f}")
+    print(f"threads {threads} -> {final_threads}, pending timers {pending}, live timer objects {live}")
+    
+    failures = []
+    if final - warm > RSS_SLACK_MIB:
+        failures.append(f"RSS grew by {final - warm:.1f} MiB after the warmup")
+    if final_threads > threads:
+        failures.append(f"thread count grew from {threads} to {final_threads}")
+    if live > TIMERS:
+        failures.append(f"{live} timer objects alive, expected {TIMERS}")
+    
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+import socket
+import threading
+import time
+
+from clu_emulator.cipher import CluCipher
+from clu_emulator.clu_client import CluClient
+
+# Remote lua requests per second from CluClient to a stand-in CLU on
+# 127.0.0.1:1234, which answers every request with the number 42. Requests
+# are sent from 1 and 8 threads sharing the client.
+#
+#   python -m benchmarks.remote_requests
+
+REQUESTS = 4000
+THREADS = (1, 8)
+
+
+def stand_in(sock: socket.socket, cipher: CluCipher) -> None:
+    while True:
+        data, addr = sock.recvfrom(1024)
+        session_id = cipher.decrypt(data).decode().split(":")[2]
+        sock.sendto(cipher.encrypt(f"resp:127.0.0.1:{session_id}:n42;".encode()), addr)
+
+def main() -> None:
+    cipher = CluCipher(bytes(16), bytes(16))
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 1234))
+    threading.Thread(target=stand_in, args=(sock, CluCipher(bytes(16), bytes(16))), daemon=True).start()
+    
+    client = CluClient("127.0.0.1", cipher, 1, "127.0.0.1")
+    assert client.send_lua_request("42") == 42
+    
+    for count in THREADS:
+        requests = REQUESTS // count
+        
+        def worker() -> None:
+            for _ in range(requests):
+                client.send_lua_request("x")
+        
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        
+        print(f"{count} thread(s): {requests * count / elapsed:.0f} req/s")
+    
+    client.close()
+
+if __name__ == "__main__":
+    main()
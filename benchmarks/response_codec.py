@@ -0,0 +1,62 @@
+import time
+
+from clu_emulator.clu_client import _decode_values, _split_response
+from clu_emulator.utils import find_n_character
+
+# Decoding 10k remote lua responses with the tagged codec of CluClient,
+# compared to the previous "type:value" responses, which were parsed by
+# scanning for the third ':' and splitting off the type.
+#
+#   python -m benchmarks.response_codec
+
+RESPONSES = 10000
+REPEATS = 5
+
+PREVIOUS_RESPONSES = ["number:42", "number:21.5", "string:living room lamp", "boolean:true", "nil:nil"]
+TAGGED_RESPONSES = ["n42;", "d21.5;", "s16:living room lamp", "t", "z"]
+
+
+def parse_previous(resp: str):
+    index = find_n_character(resp, ':', 3)
+    if index != -1:
+        resp = resp[index + 1:]
+    
+    i = resp.find(":")
+    resp_type = resp[:i]
+    value = resp[i + 1:]
+    
+    if resp_type == "number":
+        return float(value)
+    elif resp_type == "string":
+        return value
+    elif resp_type == "boolean":
+        return value == "true"
+    else:
+        return None
+
+def parse_tagged(resp: bytes):
+    return _decode_values(_split_response(resp)[1])[0]
+
+def run(name: str, parse, responses: list) -> None:
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for resp in responses:
+            parse(resp)
+        best = min(best, time.perf_counter() - start)
+    
+    print(f"{name:32s} {best * 1000:6.2f} ms / {len(responses)} responses ({len(responses) / best / 1000:.0f}k/s)")
+
+def main() -> None:
+    header = "resp:192.168.100.200:1a2b3c4d:"
+    count = RESPONSES // len(PREVIOUS_RESPONSES)
+    
+    run("previous (find_n_character)", lambda resp: parse_previous(resp.decode()), [f"{header}{r}".encode() for r in PREVIOUS_RESPONSES] * count)
+    run("tagged codec", parse_tagged, [f"{header}{r}".encode() for r in TAGGED_RESPONSES] * count)
+    
+    # Tables were not transferable before.
+    table = header + "{n1;s4:name" + "n2;d0.5;" + "s2:on" + "t}"
+    run("tagged codec, table", parse_tagged, [table.encode()] * RESPONSES)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import contextlib
+import io
+import socket
+import threading
+import time
+
+from clu_emulator.cipher import CluCipher
+from clu_emulator.clu_server import CluServer
+
+from .common import make_config
+
+# Lua request throughput of CluServer with 50 concurrent clients, for the
+# threaded listener loop and the asyncio mode. Every request simulates 2 ms
+# of lua work that releases the GIL, like a remote call would.
+#
+#   python -m benchmarks.server_throughput
+
+CLIENTS = 50
+REQUESTS = 40
+LUA_WORK = 0.002
+
+
+def run(async_server: bool) -> tuple[int, float]:
+    config = make_config(async_server=async_server, server_workers=16)
+    server = CluServer(config, bytes(16), bytes(16), "/tmp", "127.0.0.1")
+    server.set_lua_request_handler(lambda context, payload: time.sleep(LUA_WORK) or "ok")
+    
+    # Same as start(), but on a free port.
+    server.sock.bind(("127.0.0.1", 0))
+    server.listener_thread.start()
+    addr = server.sock.getsockname()
+    
+    cipher = CluCipher(bytes(16), bytes(16))
+    replies = []
+    
+    def client(i: int) -> None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(2)
+        n = 0
+        for r in range(REQUESTS):
+            sock.sendto(cipher.encrypt(f"req:127.0.0.1:{i:x}{r:04x}:x".encode()), addr)
+            try:
+                sock.recvfrom(1024)
+                n += 1
+            except socket.timeout:
+                pass
+        replies.append(n)
+    
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    return sum(replies), time.perf_counter() - start
+
+def main() -> None:
+    for async_server in (False, True):
+        # The server prints every request.
+        with contextlib.redirect_stdout(io.StringIO()):
+            replies, elapsed = run(async_server)
+        
+        name = "asyncio" if async_server else "threaded"
+        print(f"{name:8s} {replies}/{CLIENTS * REQUESTS} replies in {elapsed:.2f} s -> {replies / elapsed:.0f} req/s")
+
+if __name__ == "__main__":
+    main()
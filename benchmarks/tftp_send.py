@@ -0,0 +1,136 @@
+import collections
+import hashlib
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from clu_emulator.tftpy.TftpContexts import TftpMetrics
+from clu_emulator.tftpy.TftpServer import TftpServer
+from clu_emulator.tftpy.TftpStates import TftpState
+
+# TFTP download of a 50 MB file over loopback, bytes/sec for the default and
+# the largest blksize. Also the cost of TftpState.sendDAT alone: time per
+# block and the memory allocated per block, traced with tracemalloc.
+#
+#   python -m benchmarks.tftp_send
+
+FILE_SIZE = 50 * 2 ** 20
+BLOCK_SIZES = (512, 1428)
+TRACED_BLOCKS = 2000
+
+
+class _SendContext:
+    """The parts of a server context sendDAT uses."""
+    
+    def __init__(self, path: str, blksize: int, sock: socket.socket, port: int) -> None:
+        self.fileobj = open(path, "rb")
+        self.file_to_transfer = path
+        self.blksize = blksize
+        self.sock = sock
+        self.host = "127.0.0.1"
+        self.tidport = port
+        self.packethook = None
+        self.metrics = TftpMetrics()
+        self.dat_buffer = None
+        self.dat_slot = 0
+        self.next_block = 0
+        self.last_pkt = None
+        # Every block counts as acknowledged once the next one is sent.
+        self.window = collections.deque(maxlen=1)
+    
+    def getBlocksize(self) -> int:
+        return self.blksize
+    
+    def getWindowsize(self) -> int:
+        return 1
+
+def download(port: int, blksize: int, digest: str) -> None:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(5)
+    
+    request = b"\x00\x01a:\\big.bin\x00octet\x00"
+    if blksize != 512:
+        request += b"blksize\x00%d\x00" % blksize
+    sock.sendto(request, ("127.0.0.1", port))
+    
+    received = hashlib.sha256()
+    buffer = bytearray(blksize + 4)
+    start = time.perf_counter()
+    while True:
+        size, addr = sock.recvfrom_into(buffer)
+        if buffer[1] == 6: # OACK
+            sock.sendto(b"\x00\x04\x00\x00", addr)
+            continue
+        
+        received.update(buffer[4:size])
+        sock.sendto(b"\x00\x04" + bytes(buffer[2:4]), addr)
+        if size - 4 < blksize:
+            break
+    elapsed = time.perf_counter() - start
+    sock.close()
+    
+    intact = received.hexdigest() == digest
+    print(f"download, blksize {blksize:4d}: {FILE_SIZE / elapsed / 1e6:6.1f} MB/s ({elapsed:.2f} s, intact={intact})")
+
+def send_blocks(path: str, blksize: int) -> None:
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    
+    context = _SendContext(path, blksize, sock, sink.getsockname()[1])
+    state = TftpState(context)
+    
+    blocks = 0
+    start = time.perf_counter()
+    finished = False
+    while not finished:
+        blocks += 1
+        context.next_block = blocks & 0xffff
+        finished = state.sendDAT()
+    elapsed = time.perf_counter() - start
+    
+    context.fileobj.seek(0)
+    tracemalloc.start()
+    state.sendDAT() # the first block allocates the reused buffer
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for i in range(TRACED_BLOCKS):
+        context.next_block = (i + 2) & 0xffff
+        state.sendDAT()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    print(f"sendDAT,  blksize {blksize:4d}: {elapsed / blocks * 1e6:6.2f} us/block, "
+          f"{(after - before) / TRACED_BLOCKS:.1f} B retained and {peak - before} B peak over {TRACED_BLOCKS} blocks")
+    
+    context.fileobj.close()
+    sock.close()
+    sink.close()
+
+def main() -> None:
+    logging.disable(logging.CRITICAL)
+    
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "big.bin")
+        with open(path, "wb") as file:
+            file.write(os.urandom(FILE_SIZE))
+        with open(path, "rb") as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        
+        server = TftpServer(root)
+        threading.Thread(target=server.listen, args=("127.0.0.1", 0), daemon=True).start()
+        server.is_running.wait()
+        
+        for blksize in BLOCK_SIZES:
+            download(server.listenport, blksize, digest)
+        for blksize in BLOCK_SIZES:
+            send_blocks(path, blksize)
+        
+        server.stop(True)
+
+if __name__ == "__main__":
+    main()
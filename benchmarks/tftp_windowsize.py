@@ -0,0 +1,62 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from clu_emulator.tftpy.TftpClient import TftpClient
+from clu_emulator.tftpy.TftpServer import TftpServer
+
+# TFTP download and upload time of a 10 MB file over loopback for window
+# sizes 1 to 64 (RFC 7440). A window size of 1 is the lockstep transfer.
+#
+#   python -m benchmarks.tftp_windowsize
+
+FILE_SIZE = 10 * 2 ** 20
+BLOCK_SIZE = 1428
+WINDOW_SIZES = (1, 2, 4, 8, 16, 32, 64)
+TIMEOUT = 0.2
+RETRIES = 50
+
+
+def main() -> None:
+    logging.disable(logging.CRITICAL)
+    
+    with tempfile.TemporaryDirectory() as root:
+        data = os.urandom(FILE_SIZE)
+        with open(os.path.join(root, "file.bin"), "wb") as file:
+            file.write(data)
+        digest = hashlib.sha256(data).hexdigest()
+        
+        server = TftpServer(root)
+        threading.Thread(target=server.listen, args=("127.0.0.1", 0, TIMEOUT, RETRIES), daemon=True).start()
+        server.is_running.wait()
+        
+        for windowsize in WINDOW_SIZES:
+            options = {"blksize": BLOCK_SIZE}
+            if windowsize > 1:
+                options["windowsize"] = windowsize
+            
+            output = io.BytesIO()
+            start = time.perf_counter()
+            TftpClient("127.0.0.1", server.listenport, options).download("a:\\file.bin", output, timeout=TIMEOUT, retries=RETRIES)
+            download = time.perf_counter() - start
+            intact = hashlib.sha256(output.getvalue()).hexdigest() == digest
+            
+            start = time.perf_counter()
+            TftpClient("127.0.0.1", server.listenport, options).upload("a:\\upload.bin", io.BytesIO(data), timeout=TIMEOUT, retries=RETRIES)
+            upload = time.perf_counter() - start
+            # the server closes the uploaded file after the final ACK is sent
+            time.sleep(0.05)
+            with open(os.path.join(root, "upload.bin"), "rb") as file:
+                intact = intact and hashlib.sha256(file.read()).hexdigest() == digest
+            
+            print(f"windowsize {windowsize:2d}: download {FILE_SIZE / download / 1e6:5.1f} MB/s ({download:.2f} s), "
+                  f"upload {FILE_SIZE / upload / 1e6:5.1f} MB/s ({upload:.2f} s), intact={intact}")
+        
+        server.stop(True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import logging
+import resource
+import tempfile
+import threading
+import time
+
+from .common import make_engine, write_lua_config
+
+# 1000 cyclic 20 ms timers running for 5 seconds. Reports the expiries against
+# the ideal count, the threads running the timers, the cpu time and the
+# number of context switches.
+#
+#   python -m benchmarks.timers
+
+TIMERS = 1000
+PERIOD_MS = 20
+DURATION = 5.0
+
+# The timers are set up from python, as lupa does not reliably tell a
+# method call with an explicit self argument from one without.
+OM = f"""CLU = GATE:new()
+T = {{}}
+for i = 1, {TIMERS} do T[i] = OBJECT:new(6, i) end
+fired = 0
+function count() fired = fired + 1 end
+"""
+
+
+def main() -> None:
+    logging.disable(logging.CRITICAL)
+    
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_lua_config(config_dir, OM)
+        engine = make_engine(config_dir)
+        lua = engine.lua.globals()
+        timers = [lua.T[i] for i in range(1, TIMERS + 1)]
+        with engine.request_lock:
+            for timer in timers:
+                timer.set(0, PERIOD_MS)
+                timer.set(1, 1)
+                timer.add_event(0, lua.count)
+        idle_threads = threading.active_count()
+        
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        with engine.request_lock:
+            for timer in timers:
+                timer.start()
+        
+        time.sleep(DURATION / 2)
+        threads = threading.active_count()
+        time.sleep(DURATION / 2)
+        
+        with engine.request_lock:
+            elapsed = time.perf_counter() - start
+            fired = lua.fired
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        engine.close()
+    
+    cpu = after.ru_utime - before.ru_utime + after.ru_stime - before.ru_stime
+    switches = after.ru_nvcsw - before.ru_nvcsw + after.ru_nivcsw - before.ru_nivcsw
+    ideal = int(TIMERS * elapsed * 1000 / PERIOD_MS)
+    print(f"{TIMERS} cyclic {PERIOD_MS} ms timers, {elapsed:.1f} s: {fired} expiries (ideal {ideal}), "
+          f"threads {idle_threads} -> {threads}, cpu {cpu:.2f} s, {switches} context switches")
+
+if __name__ == "__main__":
+    main()
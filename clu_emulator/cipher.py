@@ -1,44 +1,130 @@
+import threading
 from base64 import b64decode
 
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
+BLOCK_SIZE = 16
 
+
+def _xor_block(a: bytes, b: bytes, c: bytes) -> bytes:
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big") ^ int.from_bytes(c, "big")).to_bytes(BLOCK_SIZE, "big")
+
+def _pad(data: bytes) -> bytes:
+    pad = BLOCK_SIZE - len(data) % BLOCK_SIZE
+    return data + bytes((pad,)) * pad
+
+def _unpad(data: bytes) -> bytes:
+    pad = data[-1]
+    if not 1 <= pad <= BLOCK_SIZE or data[-pad:] != bytes((pad,)) * pad:
+        raise ValueError("Invalid padding bytes.")
+    return data[:-pad]
+
+def _check_length(data: bytes) -> None:
+    if len(data) == 0 or len(data) % BLOCK_SIZE != 0:
+        raise ValueError("The length of the provided data is not a multiple of the block length.")
+
+# AES-128-CBC with PKCS7 padding. The encryptor and decryptor contexts are
+# created once per key and never finalized. CBC only carries the previous
+# ciphertext block between calls, so a message can be started with any iv by
+# folding the context's current chaining block into the first block.
 class CluCipher:
 
     def __init__(self, key: str | bytes, iv: str | bytes) -> None:
         self._key = None
         self._iv = None
-        self._cipher = None
-        
-        self.set_key(key, iv)    
-        
-        self._padding = padding.PKCS7(128)
-        
+        self._lock = threading.Lock()
+
+        self.set_key(key, iv)
+
     def set_key(self, key: str | bytes, iv: str | bytes) -> None:
         if isinstance(key, str):
-            self._key = b64decode(key)
-        else:
-            self._key = key
-            
+            key = b64decode(key)
+
         if isinstance(iv, str):
-            self._iv = b64decode(iv)
-        else:
+            iv = b64decode(iv)
+
+        with self._lock:
+            self._key = key
             self._iv = iv
-            
-        self._cipher = Cipher(
-            algorithms.AES(self._key), modes.CBC(self._iv), backend=default_backend()
-        )
-
-    def encrypt(self, data: bytes) -> bytes:
-        encryptor = self._cipher.encryptor()
-        padder = self._padding.padder()
-        data = padder.update(data) + padder.finalize()
-        return encryptor.update(data) + encryptor.finalize()
-
-    def decrypt(self, data: bytes) -> bytes:
-        decryptor = self._cipher.decryptor()
-        unpadder = self._padding.unpadder()
-        data = decryptor.update(data) + decryptor.finalize()
-        return unpadder.update(data) + unpadder.finalize()
+
+            # The chaining block starts out as the all zero iv of the contexts.
+            self._encryptor = Cipher(
+                algorithms.AES(self._key), modes.CBC(bytes(BLOCK_SIZE)), backend=default_backend()
+            ).encryptor()
+            self._encryptor_state = bytes(BLOCK_SIZE)
+
+            self._decryptor = Cipher(
+                algorithms.AES(self._key), modes.CBC(bytes(BLOCK_SIZE)), backend=default_backend()
+            ).decryptor()
+            self._decryptor_state = bytes(BLOCK_SIZE)
+
+            # ECB keeps no state between blocks, so one decryptor can be reused for all block peeks.
+            self._block_decryptor = Cipher(
+                algorithms.AES(self._key), modes.ECB(), backend=default_backend()
+            ).decryptor()
+
+    def encrypt(self, data: bytes, iv: bytes | None = None) -> bytes:
+        with self._lock:
+            return self._encrypt(data, iv or self._iv)
+
+    def decrypt(self, data: bytes, iv: bytes | None = None) -> bytes:
+        _check_length(data)
+        with self._lock:
+            data = self._decrypt(data, iv or self._iv)
+        return _unpad(data)
+
+    def encrypt_many(self, payloads: list[bytes], iv: bytes | None = None) -> list[bytes]:
+        iv = iv or self._iv
+        with self._lock:
+            return [self._encrypt(data, iv) for data in payloads]
+
+    def decrypt_many(self, payloads: list[bytes], iv: bytes | None = None) -> list[bytes]:
+        # all payloads go through the cipher context in a single pass
+        for data in payloads:
+            _check_length(data)
+
+        iv = iv or self._iv
+        with self._lock:
+            out = self._decryptor.update(b"".join(payloads))
+
+            results = []
+            offset = 0
+            prev = self._decryptor_state
+            for data in payloads:
+                first = _xor_block(out[offset:offset + BLOCK_SIZE], prev, iv)
+                results.append(first + out[offset + BLOCK_SIZE:offset + len(data)])
+                offset += len(data)
+                prev = data[-BLOCK_SIZE:]
+
+            self._decryptor_state = prev
+
+        return [_unpad(data) for data in results]
+
+    # Decrypts a single block of a CBC encrypted message without touching the rest of it.
+    def decrypt_block(self, data: bytes, index: int = 0) -> bytes:
+        start = index * BLOCK_SIZE
+        block = data[start:start + BLOCK_SIZE]
+        # The shared ECB context would keep a partial block and return garbage for every later peek.
+        if index < 0 or len(block) != BLOCK_SIZE:
+            raise ValueError("The requested block is not a whole block of the provided data.")
+        prev = self._iv if index == 0 else data[start - BLOCK_SIZE:start]
+
+        with self._lock:
+            block = self._block_decryptor.update(block)
+        return (int.from_bytes(block, "big") ^ int.from_bytes(prev, "big")).to_bytes(len(block), "big")
+
+    def _encrypt(self, data: bytes, iv: bytes) -> bytes:
+        data = _pad(data)
+        first = _xor_block(data[:BLOCK_SIZE], iv, self._encryptor_state)
+
+        out = self._encryptor.update(first + data[BLOCK_SIZE:])
+        self._encryptor_state = out[-BLOCK_SIZE:]
+        return out
+
+    def _decrypt(self, data: bytes, iv: bytes) -> bytes:
+        out = self._decryptor.update(data)
+        first = _xor_block(out[:BLOCK_SIZE], self._decryptor_state, iv)
+
+        self._decryptor_state = data[-BLOCK_SIZE:]
+        return first + out[BLOCK_SIZE:]
@@ -1,9 +1,11 @@
 
+import heapq
+import itertools
 import socket
 import threading
 import time
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Callable
 
 from clu_emulator.objects.grenton_object import Feature
 
@@ -13,6 +15,7 @@ from .clu_cloud import CloudCommunicator
 from .utils import fetch_values
 
 CLIENT_LIFE_TIME = 60
+CLIENT_REPORT_COALESCE_TIME = 0.05
 
 class Observable(ABC):
     
@@ -32,20 +35,42 @@ class Observable(ABC):
         out = self.prev_val != new_val
         self.prev_val = new_val
         
-        for client in self.clients:
-            client.set_update_flag()
+        if out:
+            for client in self.clients:
+                client.set_update_flag()
         
         return out
 
+    def unlink(self) -> None:
+        pass
+
     @abstractmethod
     def value(self) -> Any:
         raise NotImplementedError
     
 class ObservableFeature(Observable):
     
-    def __init__(self, feature: Feature):
+    def __init__(self, feature: Feature, on_change: Callable[[], None]):
         self.feature = feature
+        self.changed = False
+        self._on_change = on_change
         super().__init__()
+        
+        self.feature.add_value_change_handler(self._value_changed)
+        
+    def _value_changed(self, value) -> None:
+        self.changed = True
+        self._on_change()
+        
+    def update(self) -> bool:
+        if not self.changed:
+            return False
+        self.changed = False
+        
+        return super().update()
+    
+    def unlink(self) -> None:
+        self.feature.remove_value_change_handler(self._value_changed)
     
     def value(self) -> Any:
         return self.feature.get_value()
@@ -72,7 +97,7 @@ class Client:
         self.session_id = session_id
         self.observables = observables
         self.update_flag = False
-        self.registration_timestamp = time.time()
+        self.expires_at = time.monotonic() + CLIENT_LIFE_TIME
         
         for ob in observables:
             ob.add_client(self)
@@ -111,16 +136,30 @@ class ClientManager:
         self._clients_local: dict[tuple[str, int, int], LocalClient] = {}
         self._clients_lock = threading.RLock()
         
+        # (expires_at, seq, client) entries. Re-registering or destroying a
+        # client leaves its old entry behind; it is skipped when popped.
+        self._expiry_heap: list[tuple[float, int, Client]] = []
+        self._expiry_seq = itertools.count()
+        
         self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
+        # Feature observables wake the manager thread when their value changes.
+        # User variables have no change notification and are polled every
+        # client report interval.
         self._client_report_interval = 1.0
+        self._next_poll = time.monotonic()
+        
+        # Number of times a client was checked in a poll and had nothing to report.
+        self.suppressed_reports = 0
 
         self._manager_thread = threading.Thread(target=self._manager_loop, daemon=True)
         self._manager_thread.start()
         
     def close(self):
         self._stop_event.set()
+        self._wake_event.set()
         self._manager_thread.join()
         self._sock.close()
         
@@ -148,6 +187,9 @@ class ClientManager:
                 self._clients_local.pop(key).unlink_observables()
                 
             self._clients_local[key] = client
+            self._schedule_expiry(client)
+            
+        self._wake_event.set()
         
     def destroy_client(self, ip: str, port: int, client_id: int) -> None:
         if not (isinstance(ip, str) and isinstance(port, int) and isinstance(client_id, int)):
@@ -178,6 +220,9 @@ class ClientManager:
                 self._clients_mqtt.pop(key).unlink_observables()
                 
             self._clients_mqtt[key] = client
+            self._schedule_expiry(client)
+            
+        self._wake_event.set()
         
     def destroy_mqtt(self, client_id: str) -> None:
         if not isinstance(client_id, str):
@@ -200,7 +245,10 @@ class ClientManager:
                 client.unlink_observables()
             self._clients_mqtt.clear()
             
+            for ob in self._observables:
+                ob.unlink()
             self._observables.clear()
+            self._expiry_heap.clear()
             self._observables_f.clear()
             self._observables_uv.clear()
         
@@ -214,47 +262,100 @@ class ClientManager:
         
         if obj in self._observables_f.keys():
             return self._observables_f[obj]
-        ob = ObservableFeature(obj)
+        ob = ObservableFeature(obj, self._wake_event.set)
         self._observables_f[obj] = ob
         return ob
         
-    def _send_message(self, request_id: int, msg: str, ip: str, port: int) -> None:
-        try:
-            payload = f"resp:{self._hostip}:{hex(request_id)[2:]}:{msg}"
-            self._sock.sendto(self._cipher.encrypt(payload.encode()), (ip, port))
-        except IOError:
-            print("Cannot send update message.")
+    def _send_messages(self, messages: list[tuple[int, str, str, int]]) -> None:
+        if not messages:
+            return
+        
+        payloads = [f"resp:{self._hostip}:{hex(request_id)[2:]}:{msg}".encode() for request_id, msg, _, _ in messages]
+        for data, (_, _, ip, port) in zip(self._cipher.encrypt_many(payloads), messages):
+            try:
+                self._sock.sendto(data, (ip, port))
+            except IOError:
+                print("Cannot send update message.")
             
+    def _schedule_expiry(self, client: Client) -> None:
+        heapq.heappush(self._expiry_heap, (client.expires_at, next(self._expiry_seq), client))
+        
+        # Drop stale entries once they outnumber the live ones.
+        if len(self._expiry_heap) > 2 * (len(self._clients_local) + len(self._clients_mqtt)) + 64:
+            clients = itertools.chain(self._clients_local.values(), self._clients_mqtt.values())
+            self._expiry_heap = [(c.expires_at, next(self._expiry_seq), c) for c in clients]
+            heapq.heapify(self._expiry_heap)
+            
+    def _expire_clients(self) -> None:
+        now = time.monotonic()
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, _, client = heapq.heappop(self._expiry_heap)
+            
+            if isinstance(client, LocalClient):
+                clients, key = self._clients_local, (client.ip, client.port, client.client_id)
+            else:
+                clients, key = self._clients_mqtt, client.client_id
+                
+            if clients.get(key) is client:
+                clients.pop(key).unlink_observables()
+    
+    def _next_wakeup(self) -> float | None:
+        timeouts = []
+        if self._observables_uv:
+            timeouts.append(self._next_poll - time.monotonic())
+            
+        if self._expiry_heap:
+            timeouts.append(self._expiry_heap[0][0] - time.monotonic())
+            
+        if not timeouts:
+            return None
+        return max(0, min(timeouts))
+    
     def _manager_loop(self):
         while True:
             with self._clients_lock:
+                timeout = self._next_wakeup()
+            
+            self._wake_event.wait(timeout)
+            
+            # Give changes that arrive together a moment to end up in the same report.
+            if self._stop_event.wait(CLIENT_REPORT_COALESCE_TIME):
+                break
+            self._wake_event.clear()
+            
+            with self._clients_lock:
+                poll = time.monotonic() >= self._next_poll
+                if poll:
+                    self._next_poll = time.monotonic() + self._client_report_interval
+                
                 for ob in self._observables.copy():
                     if len(ob.clients) == 0:
                         self._observables.remove(ob)
+                        ob.unlink()
                         if isinstance(ob, ObservableFeature):
                             self._observables_f.pop(ob.feature)
                         elif isinstance(ob, ObservableUserVariable):
                             self._observables_uv.pop(ob.name)
-                    else:
+                    elif poll or isinstance(ob, ObservableFeature):
                         ob.update()
                 
+                reports = []
                 for client in list(self._clients_local.values()):
                     if client.update_flag:
                         client.update_flag = False
                         payload = f"clientReport:{client.client_id}:{fetch_values(map(lambda x: x.value(), client.observables))}"
-                        self._send_message(client.session_id, payload, client.ip, client.port)
-                    
-                    if time.time() - client.registration_timestamp >= CLIENT_LIFE_TIME:
-                        self.destroy_client(client.ip, client.port, client.client_id)
+                        reports.append((client.session_id, payload, client.ip, client.port))
+                    elif poll:
+                        self.suppressed_reports += 1
+                        
+                self._send_messages(reports)
             
                 for client in list(self._clients_mqtt.values()):
                     if client.update_flag:
                         client.update_flag = False
                         payload = f"clientReport:1:{fetch_values(map(lambda x: x.value(), client.observables))}"
                         self._cloud.send_update_message(client.session_id, client.client_id, payload)
-                    
-                    if time.time() - client.registration_timestamp >= CLIENT_LIFE_TIME:
-                        self.destroy_mqtt(client.client_id)
-
-            if self._stop_event.wait(self._client_report_interval):
-                break
\ No newline at end of file
+                    elif poll:
+                        self.suppressed_reports += 1
+                        
+                self._expire_clients()
@@ -0,0 +1,43 @@
+import threading
+import time
+
+from .scheduler import ScheduledCall, Scheduler
+
+
+# Drives all time based features from one tick per second on the shared
+# scheduler. Features compute their value when read; the tick only exists to
+# notify value change handlers, e.g. registered clients.
+class ClockService:
+    
+    def __init__(self, scheduler: Scheduler) -> None:
+        self._scheduler = scheduler
+        self._features: set = set()
+        self._lock = threading.Lock()
+        self._call: ScheduledCall | None = None
+        
+    def add_feature(self, feature) -> None:
+        with self._lock:
+            self._features.add(feature)
+            if self._call is None:
+                self._schedule()
+                
+    def clear(self) -> None:
+        with self._lock:
+            self._features.clear()
+            if self._call:
+                self._call.cancel()
+                self._call = None
+                
+    def _schedule(self) -> None:
+        # Ticks land just after a whole second, when the unix time changes.
+        self._call = self._scheduler.call_later(1 - time.time() % 1, self._tick)
+        
+    def _tick(self) -> None:
+        with self._lock:
+            if self._call is None:
+                return
+            self._schedule()
+            features = list(self._features)
+            
+        for feature in features:
+            feature.tick()
@@ -1,21 +1,177 @@
 
+import logging
 import random
+import re
 import socket
+import threading
+import time
+from typing import Any, Callable
 
 from .cipher import CluCipher
-from .utils import find_n_character, get_host_ip
+from .utils import get_host_ip
 
+MAX_DATAGRAM_SIZE = 1024
+# Room left for the encoded values in a response datagram, after
+# "resp:<ip>:<session id>:" (at most 30 bytes) and one byte of padding.
+MAX_RESPONSE_VALUES_SIZE = MAX_DATAGRAM_SIZE - 31
+
+# Remote CLUs drop registered clients after 60 s without renewal.
+SUBSCRIPTION_RENEW_TIME = 45
+SUBSCRIPTION_RETRY_TIME = 5
+
+REPORT_VALUE_PATTERN = re.compile(r'"[^"]*"|[^,]+')
+
+
+# Encoder installed once on the remote CLU as a global function, requests
+# only call it. It takes any number of values and writes every value as a
+# tag followed by its data, so the response can be decoded in one pass:
+#   z            nil (and values that cannot be transferred)
+#   t / f        boolean
+#   n<integer>;  integer number
+#   d<float>;    float number, with all 17 significant digits
+#   s<len>:<...> string, length in bytes
+#   {<k><v>...}  table, encoded key/value pairs
+# Values that would not fit in a response datagram are answered with "!".
+# The name carries a version, so remote CLUs that still have an older
+# encoder installed get the current one.
+LUA_ENCODER_NAME = "_EMU_ENCODE2"
+LUA_ENCODER = (
+    "local function e(v, d) "
+    "local t = type(v) "
+    "if t == 'number' then "
+    "if math.type(v) == 'integer' then return 'n' .. string.format('%d', v) .. ';' end "
+    "return 'd' .. string.format('%.17g', v) .. ';' "
+    "elseif t == 'string' then return 's' .. #v .. ':' .. v "
+    "elseif t == 'boolean' then return v and 't' or 'f' "
+    "elseif t == 'table' and d < 8 then "
+    "local r = {'{'} "
+    "for k, x in pairs(v) do r[#r + 1] = e(k, d + 1) r[#r + 1] = e(x, d + 1) end "
+    "r[#r + 1] = '}' "
+    "return table.concat(r) "
+    "end "
+    "return 'z' "
+    "end "
+    f"function {LUA_ENCODER_NAME}(...) "
+    "local r = {} "
+    "for i = 1, select('#', ...) do r[i] = e((select(i, ...)), 0) end "
+    "r = table.concat(r) "
+    f"return #r > {MAX_RESPONSE_VALUES_SIZE} and '!' or r "
+    "end"
+)
+# Response of a request when the encoder is not installed, e.g. after the remote CLU restarted.
+ENCODER_MISSING = b"?"
+RESPONSE_TOO_LARGE = b"!"
+
+def _escape_lua_string(string: str) -> str:
+    return string.replace('\\', '\\\\').replace('"', '\\"')
+
+def _decode_number(data: bytes) -> int | float:
+    try:
+        return int(data)
+    except ValueError:
+        return float(data)
+
+def _decode_value(data: bytes, i: int) -> tuple[Any, int]:
+    tag = data[i]
+    if tag == 0x6e: # n
+        end = data.index(b";", i + 1)
+        return int(data[i + 1:end]), end + 1
+    elif tag == 0x64: # d
+        end = data.index(b";", i + 1)
+        return float(data[i + 1:end]), end + 1
+    elif tag == 0x73: # s
+        sep = data.index(b":", i + 1)
+        start = sep + 1
+        end = start + int(data[i + 1:sep])
+        return data[start:end].decode(), end
+    elif tag == 0x74: # t
+        return True, i + 1
+    elif tag == 0x66: # f
+        return False, i + 1
+    elif tag == 0x7b: # {
+        table = {}
+        i += 1
+        while data[i] != 0x7d: # }
+            key, i = _decode_value(data, i)
+            table[key], i = _decode_value(data, i)
+        return table, i + 1
+    else:
+        return None, i + 1
+
+def _decode_values(data: bytes) -> list[Any]:
+    values = []
+    i = 0
+    while i < len(data):
+        value, i = _decode_value(data, i)
+        values.append(value)
+
+    return values
+
+# "clientReport:<client id>:{<value>,...}", the values are written by fetch_values
+def _parse_report(payload: bytes) -> list[Any] | None:
+    split = payload.decode(errors="replace").split(':', 2)
+    if len(split) < 3 or split[0] != "clientReport":
+        return None
+
+    values = []
+    for token in REPORT_VALUE_PATTERN.findall(split[2].strip()[1:-1]):
+        token = token.strip()
+        if token.startswith('"'):
+            values.append(token[1:-1])
+        elif token == "true" or token == "false":
+            values.append(token == "true")
+        elif token == "nil":
+            values.append(None)
+        else:
+            try:
+                values.append(_decode_number(token))
+            except ValueError:
+                values.append(None)
+
+    return values
 
-def _extract_payload(resp: str) -> str:
-    index = find_n_character(resp, ':', 3)
-    if index == -1:
-        return resp
-         
-    return resp[index + 1:]
-        
 def _generate_id_hex(lenght=8) -> str:
         return ''.join(random.choices("01234567890abcdef", k=lenght))
-    
+
+# "resp:<ip>:<session id>:<payload>"
+def _split_response(resp: bytes) -> tuple[int | None, bytes]:
+    split = resp.split(b':', 3)
+    if len(split) < 4 or split[0] != b"resp":
+        return None, resp
+
+    try:
+        return int(split[2], 16), split[3]
+    except ValueError:
+        return None, resp
+
+class _PendingRequest:
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.response: bytes | None = None
+
+class _Subscription:
+
+    def __init__(self, client_id: int, observables: str, on_report: Callable[[list[Any]], None]) -> None:
+        self.client_id = client_id
+        self.observables = observables
+        self.on_report = on_report
+        self.renew_at = 0.0
+
+_clients: dict[str, "CluClient"] = {}
+_clients_lock = threading.Lock()
+
+def get_clu_client(ip: str, cipher: CluCipher, timeout: float = 1) -> "CluClient":
+    with _clients_lock:
+        client = _clients.get(ip)
+        if client is None or client._cipher is not cipher:
+            if client:
+                client.close()
+            client = CluClient(ip, cipher, timeout)
+            _clients[ip] = client
+
+        return client
+
 class CluClient:
 
     def __init__(
@@ -27,48 +183,265 @@ class CluClient:
     ) -> None:
         self._addr = (ip, 1234)
         self._timeout = timeout
-        
+
         if hostip:
             self._local_ip = hostip
         else:
             self._local_ip = get_host_ip(ip)
-            
+
         self._cipher = cipher
 
+        # All lua requests to this CLU share one socket. Responses are matched
+        # to the waiting request by session id, anything else is dropped.
+        self._sock: socket.socket | None = None
+        self._pending: dict[int, _PendingRequest] = {}
+        self._pending_lock = threading.Lock()
+        self._receiver_thread: threading.Thread | None = None
+
+        # Client registrations on the remote CLU, by the session id their
+        # reports are sent with. Renewed by a separate thread.
+        self._subscriptions: dict[int, _Subscription] = {}
+        self._renewal_thread: threading.Thread | None = None
+        self._stop_event = threading.Event()
+
+    def close(self) -> None:
+        self._stop_event.set()
+        with self._pending_lock:
+            if self._sock:
+                try:
+                    self._sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self._sock.close()
+                self._sock = None
+
     def send_request(self, msg: str) -> str:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.settimeout(self._timeout)
-        
+
         payload = self._cipher.encrypt(msg.encode())
-        
+
         try:
             sock.sendto(payload, self._addr)
             resp, _ = sock.recvfrom(1024)
-                
+
             return self._cipher.decrypt(resp).decode()
         except Exception as e:
             raise e
         finally:
             sock.close()
 
+    def send_session_request(self, session_id: str, msg: str) -> bytes:
+        return self.send_session_requests([(session_id, msg)])[0]
+
+    # Sends all requests at once and waits for every response payload.
+    def send_session_requests(self, requests: list[tuple[str, str]]) -> list[bytes]:
+        pending = [(int(session_id, 16), _PendingRequest()) for session_id, _ in requests]
+        payloads = self._cipher.encrypt_many([msg.encode() for _, msg in requests])
+
+        with self._pending_lock:
+            for key, request in pending:
+                if key in self._pending:
+                    raise ValueError(f"Session {hex(key)[2:]} is already in flight")
+                self._pending[key] = request
+            sock = self._get_socket()
+
+        try:
+            for payload in payloads:
+                sock.sendto(payload, self._addr)
+
+            deadline = time.monotonic() + self._timeout
+            for _, request in pending:
+                if not request.event.wait(max(0, deadline - time.monotonic())):
+                    raise socket.timeout(f"No response from {self._addr[0]}")
+
+            return [request.response for _, request in pending]
+        finally:
+            with self._pending_lock:
+                for key, _ in pending:
+                    self._pending.pop(key, None)
+
     def send_lua_request(self, payload):
-        req_id = _generate_id_hex()
-        payload = f'req:{self._local_ip}:{req_id}:(load("result = {payload} return (type(result) .. \\\":\\\" .. tostring(result))")())' # basically remote code execution
-    
-        resp = self.send_request(payload)
-        resp = _extract_payload(resp)
-        
-        i = resp.find(":")
-        
-        resp_type = resp[:i]
-        value = resp[i+1:]
-        
-        if resp_type == "number":
-            return float(value)
-        elif resp_type == "string":
-            return value
-        elif resp_type == "boolean":
-            return value == "true"
-        else:
-            return None
-    
\ No newline at end of file
+        return self._evaluate_batches([[payload]])[0]
+
+    # Evaluates all expressions on the remote CLU and returns their values in order.
+    # Expressions are packed into as few requests as the datagram size allows.
+    def send_lua_batch(self, expressions: list[str]) -> list[Any]:
+        batches = []
+        batch: list[str] = []
+        for expression in expressions:
+            if batch and not self._fits_datagram(batch + [expression]):
+                batches.append(batch)
+                batch = []
+            batch.append(expression)
+
+        if batch:
+            batches.append(batch)
+
+        return self._evaluate_batches(batches)
+
+    # A batch whose values do not fit in one response is split in half and sent again.
+    def _evaluate_batches(self, batches: list[list[str]]) -> list[Any]:
+        values = []
+        for batch, resp in zip(batches, self._send_lua_requests(batches)):
+            if resp != RESPONSE_TOO_LARGE:
+                values.extend(_decode_values(resp))
+            elif len(batch) == 1:
+                raise ValueError(f"The value of {batch[0]} does not fit in a response datagram")
+            else:
+                half = len(batch) // 2
+                values.extend(self._evaluate_batches([batch[:half], batch[half:]]))
+
+        return values
+
+    # Registers as a client of the remote CLU. observables is the lua table
+    # passed to SYSTEM:clientRegister, on_report gets the values of every
+    # report, including the first one. Returns the client id.
+    def register_client(self, observables: str, on_report: Callable[[list[Any]], None]) -> int:
+        with self._pending_lock:
+            client_id = random.randrange(1, 0x7fffffff)
+            while any(sub.client_id == client_id for sub in self._subscriptions.values()):
+                client_id = random.randrange(1, 0x7fffffff)
+
+        subscription = _Subscription(client_id, observables, on_report)
+        session_id = self._new_session_id()
+
+        # Reports can arrive before the response, so the subscription goes in first.
+        with self._pending_lock:
+            self._subscriptions[int(session_id, 16)] = subscription
+            if self._renewal_thread is None:
+                self._renewal_thread = threading.Thread(target=self._renewal_loop, daemon=True)
+                self._renewal_thread.start()
+
+        try:
+            self._register(session_id, subscription)
+        except Exception:
+            with self._pending_lock:
+                self._subscriptions.pop(int(session_id, 16), None)
+            raise
+
+        return client_id
+
+    def destroy_client(self, client_id: int) -> None:
+        with self._pending_lock:
+            for key, subscription in list(self._subscriptions.items()):
+                if subscription.client_id == client_id:
+                    self._subscriptions.pop(key)
+            port = self._get_socket().getsockname()[1]
+
+        session_id = self._new_session_id()
+        self.send_session_request(session_id, f'req:{self._local_ip}:{session_id}:SYSTEM:clientDestroy("{self._local_ip}", {port}, {client_id})')
+
+    def _register(self, session_id: str, subscription: _Subscription) -> None:
+        with self._pending_lock:
+            port = self._get_socket().getsockname()[1]
+
+        msg = f'req:{self._local_ip}:{session_id}:SYSTEM:clientRegister("{self._local_ip}", {port}, {subscription.client_id}, {subscription.observables})'
+        values = _parse_report(self.send_session_request(session_id, msg))
+        if values is None:
+            raise ValueError(f"Client registration rejected by {self._addr[0]}")
+
+        subscription.renew_at = time.monotonic() + SUBSCRIPTION_RENEW_TIME
+        subscription.on_report(values)
+
+    def _renewal_loop(self) -> None:
+        while not self._stop_event.wait(1):
+            now = time.monotonic()
+            with self._pending_lock:
+                due = [(key, sub) for key, sub in self._subscriptions.items() if sub.renew_at <= now]
+
+            for key, subscription in due:
+                try:
+                    self._register(hex(key)[2:], subscription)
+                except Exception as e:
+                    subscription.renew_at = now + SUBSCRIPTION_RETRY_TIME
+                    logging.warning(f"Cannot renew client registration on {self._addr[0]}: {e}")
+
+    # Sends one request per batch of expressions and returns the encoded
+    # values of every batch. Installs the encoder first if the remote CLU
+    # does not have it.
+    def _send_lua_requests(self, batches: list[list[str]]) -> list[bytes]:
+        responses = self.send_session_requests([self._lua_request(batch) for batch in batches])
+
+        missing = [i for i, resp in enumerate(responses) if resp == ENCODER_MISSING]
+        if missing:
+            self._install_encoder()
+            retried = self.send_session_requests([self._lua_request(batches[i]) for i in missing])
+            for i, resp in zip(missing, retried):
+                responses[i] = resp
+
+        return responses
+
+    def _install_encoder(self) -> None:
+        session_id = self._new_session_id()
+        self.send_session_request(session_id, f'req:{self._local_ip}:{session_id}:(load("{_escape_lua_string(LUA_ENCODER)}")())')
+
+    def _lua_request(self, expressions: list[str]) -> tuple[str, str]:
+        req_id = self._new_session_id()
+        values = ", ".join(f"({expression})" for expression in expressions)
+        payload = f'req:{self._local_ip}:{req_id}:({LUA_ENCODER_NAME} and {LUA_ENCODER_NAME}({values}) or "{ENCODER_MISSING.decode()}")' # basically remote code execution
+
+        return req_id, payload
+
+    def _fits_datagram(self, expressions: list[str]) -> bool:
+        _, payload = self._lua_request(expressions)
+        # PKCS7 always adds at least one byte of padding
+        return len(payload.encode()) < MAX_DATAGRAM_SIZE
+
+    def _new_session_id(self) -> str:
+        with self._pending_lock:
+            req_id = _generate_id_hex()
+            while int(req_id, 16) in self._pending or int(req_id, 16) in self._subscriptions:
+                req_id = _generate_id_hex()
+
+        return req_id
+
+    def _get_socket(self) -> socket.socket:
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.bind(("", 0))
+            self._receiver_thread = threading.Thread(target=self._receiver_loop, args=(self._sock,), daemon=True)
+            self._receiver_thread.start()
+
+        return self._sock
+
+    def _receiver_loop(self, sock: socket.socket) -> None:
+        while True:
+            try:
+                data, addr = sock.recvfrom(1024)
+            except OSError:
+                return
+
+            if addr[0] != self._addr[0]:
+                continue
+
+            # The thread is shared by every request to this CLU, so one bad
+            # datagram must not end it.
+            try:
+                self._handle_datagram(data)
+            except Exception as e:
+                logging.warning(f"Cannot handle packet from {addr[0]}: {e}")
+
+    def _handle_datagram(self, data: bytes) -> None:
+        try:
+            resp = self._cipher.decrypt(data)
+        except ValueError:
+            return
+
+        session_id, payload = _split_response(resp)
+        with self._pending_lock:
+            pending = self._pending.get(session_id)
+            subscription = self._subscriptions.get(session_id) if pending is None else None
+
+        if subscription is not None:
+            values = _parse_report(payload)
+            if values is not None:
+                subscription.on_report(values)
+            return
+
+        if pending is None:
+            logging.debug(f"Dropping unexpected response from {self._addr[0]}: {resp}")
+            return
+
+        pending.response = payload
+        pending.event.set()
@@ -1,5 +1,11 @@
-
+import itertools
+import logging
+import queue
+import random
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 
 import paho.mqtt.client as mqtt
@@ -11,59 +17,220 @@ from .utils import parse_lua_request
 
 
 CLOUD_ENCPOINT = "a20a1h6d1nekft-ats.iot.eu-central-1.amazonaws.com"
+CLOUD_PORT = 8883
+
+PUBLISH_BATCH_SIZE = 32
+
+# Responses to requests are published ahead of queued client reports.
+PRIORITY_RESPONSE = 0
+PRIORITY_UPDATE = 1
+PRIORITY_STOP = 2
+
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 120.0
 
 class CloudCommunicator:
-    
-    def __init__(self, config: Config, cipher: CluCipher) -> None:
+
+    def __init__(self, config: Config, cipher: CluCipher, host: str = CLOUD_ENCPOINT, port: int = CLOUD_PORT, tls: bool = True) -> None:
         self._config = config
         self._cipher = cipher
-        
+
+        self._request_handler = lambda x, y: None
+
+        # Outgoing messages are queued as plaintext and published in batches by
+        # a separate thread, incoming requests are handled on a worker pool so
+        # lua execution does not block paho's network loop.
+        self._outbound: queue.PriorityQueue[tuple[int, int, tuple[str, str, float] | None]] = queue.PriorityQueue(config.cloud_queue_size)
+        self._outbound_seq = itertools.count()
+        self._executor = ThreadPoolExecutor(max_workers=config.cloud_workers)
+        self._publisher_thread = threading.Thread(target=self._publisher_loop, daemon=True)
+
+        # Client reports that could not be published while the broker was
+        # unreachable, newest report per client. Flushed on reconnect.
+        self._pending: OrderedDict[str, tuple[str, str, float]] = OrderedDict()
+        self._pending_lock = threading.Lock()
+
+        self.published_messages = 0
+        self.dropped_messages = 0
+        self.total_publish_latency = 0.0
+        self.max_publish_latency = 0.0
+
+        self.reconnects = 0
+        self.failed_connection_attempts = 0
+        self.total_outage_time = 0.0
+        self.last_outage_time = 0.0
+
+        self._connected = threading.Event()
+        self._stop_event = threading.Event()
+        self._ever_connected = False
+        self._outage_start: float | None = None
+        self._reconnect_delay = RECONNECT_MIN_DELAY
+
         self._client = mqtt.Client(client_id=f"emulator_{config.serial_number}")
-        self._client.tls_set(certfile="config/cert.pem", keyfile="config/key.pem")
-        
+        if tls:
+            self._client.tls_set(certfile="config/cert.pem", keyfile="config/key.pem")
+
+        self._client.on_connect = self._on_connect
         self._client.on_disconnect = self._on_disconect
-            
-        self._client.connect(CLOUD_ENCPOINT, 8883)
-        self._client.loop_start()
-        
         self._client.on_message = self._on_message
-        self._client.subscribe(topic=f"clu/{config.serial_number}/inbound/+")
-        
-        self._request_handler = lambda x, y: None
-        
+
+        # The network loop is run by our own thread instead of loop_start so
+        # that reconnecting never blocks inside a paho callback.
+        self._client.connect_async(host, port)
+        self._network_thread = threading.Thread(target=self._network_loop, daemon=True)
+        self._network_thread.start()
+
+        self._publisher_thread.start()
+
+    def close(self) -> None:
+        self._outbound.put((PRIORITY_STOP, next(self._outbound_seq), None))
+        self._publisher_thread.join()
+        self._executor.shutdown()
+
+        self._stop_event.set()
+        self._client.disconnect()
+        self._network_thread.join()
+
+    def is_connected(self) -> bool:
+        return self._connected.is_set()
+
     def set_request_handler(self, request_handler: Callable[[int, str], str]) -> None:
         self._request_handler = request_handler
-        
+
+    def queue_depth(self) -> int:
+        return self._outbound.qsize()
+
     def send_update_message(self, request_id: int, client_id: str, payload: str) -> None:
-        payload = f"resp:0.0.0.0:{hex(request_id)[2:]}:{payload}"
-        print(payload)
-        payload = self._cipher.encrypt(payload.encode())
-        self._client.publish(topic=f"clu/{self._config.serial_number}/outbound/{client_id}", payload=payload)
-    
-    def _on_disconect(self, client: mqtt.Client, userdata, rs) -> None:
+        message = (client_id, f"resp:0.0.0.0:{hex(request_id)[2:]}:{payload}", time.monotonic())
+        
+        # Client reports carry the full state, so when the queue is full the
+        # update is dropped and the next one brings the client up to date.
+        try:
+            self._outbound.put_nowait((PRIORITY_UPDATE, next(self._outbound_seq), message))
+        except queue.Full:
+            self.dropped_messages += 1
+            logging.debug(f"Cloud publish queue is full. Dropping update for {client_id}.")
+
+    def _publisher_loop(self) -> None:
         while True:
-            time.sleep(1000)
+            batch = [self._outbound.get()]
+            while len(batch) < PUBLISH_BATCH_SIZE:
+                try:
+                    batch.append(self._outbound.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(msg is None for _, _, msg in batch)
+            batch = [(priority, msg) for priority, _, msg in batch if msg is not None]
+
+            if batch:
+                self._publish(batch)
+
+            if stop:
+                break
+
+    def _publish(self, batch: list[tuple[int, tuple[str, str, float]]]) -> None:
+        if not self._connected.is_set():
+            for priority, msg in batch:
+                self._hold(priority, msg)
+            return
+
+        payloads = self._cipher.encrypt_many([payload.encode() for _, (_, payload, _) in batch])
+
+        for (priority, msg), data in zip(batch, payloads):
+            client_id, payload, enqueued = msg
+            logging.debug(payload)
+            info = self._client.publish(topic=f"clu/{self._config.serial_number}/outbound/{client_id}", payload=data)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self._hold(priority, msg)
+                continue
+
+            latency = time.monotonic() - enqueued
+            self.published_messages += 1
+            self.total_publish_latency += latency
+            self.max_publish_latency = max(self.max_publish_latency, latency)
+
+    def _hold(self, priority: int, msg: tuple[str, str, float]) -> None:
+        # Responses are useless once the request timed out on the other side.
+        if priority != PRIORITY_UPDATE:
+            self.dropped_messages += 1
+            return
+
+        client_id = msg[0]
+        with self._pending_lock:
+            self._pending.pop(client_id, None)
+            self._pending[client_id] = msg
+            if len(self._pending) > self._config.cloud_pending_size:
+                self._pending.popitem(last=False)
+                self.dropped_messages += 1
+
+    def _flush_pending(self) -> None:
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+
+        for msg in pending:
             try:
-                client.reconnect()
-                return
-            except:
-                pass
-    
+                self._outbound.put_nowait((PRIORITY_UPDATE, next(self._outbound_seq), msg))
+            except queue.Full:
+                self.dropped_messages += 1
+
+    def _network_loop(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self._client.reconnect()
+                while not self._stop_event.is_set():
+                    if self._client.loop(timeout=1.0) != mqtt.MQTT_ERR_SUCCESS:
+                        break
+            except Exception as e:
+                self.failed_connection_attempts += 1
+                logging.warning(f"Cannot connect to the cloud: {e}")
+
+            if self._stop_event.is_set():
+                break
+
+            # Jitter keeps many emulators from reconnecting in lockstep after a broker restart.
+            delay = self._reconnect_delay * random.uniform(0.5, 1.0)
+            self._reconnect_delay = min(self._reconnect_delay * 2, RECONNECT_MAX_DELAY)
+            self._stop_event.wait(delay)
+
+    def _on_connect(self, client: mqtt.Client, userdata, flags, rc) -> None:
+        if rc != 0:
+            logging.warning(f"Cloud refused connection: {rc}")
+            return
+
+        if self._ever_connected and self._outage_start is not None:
+            self.last_outage_time = time.monotonic() - self._outage_start
+            self.total_outage_time += self.last_outage_time
+            self.reconnects += 1
+        self._ever_connected = True
+        self._outage_start = None
+
+        self._reconnect_delay = RECONNECT_MIN_DELAY
+        client.subscribe(topic=f"clu/{self._config.serial_number}/inbound/+")
+        self._connected.set()
+        self._flush_pending()
+
+    def _on_disconect(self, client: mqtt.Client, userdata, rc) -> None:
+        self._connected.clear()
+        if self._outage_start is None:
+            self._outage_start = time.monotonic()
+        logging.warning(f"Disconnected from the cloud: {rc}")
+
     def _on_message(self, client: mqtt.Client, userdata, message: mqtt.MQTTMessage) -> None:
-        topic = message.topic
-        payload = message.payload
-        
-        client_id = topic.split('/')[-1]
-        
+        client_id = message.topic.split('/')[-1]
+        self._executor.submit(self._handle_message, client_id, message.payload)
+
+    def _handle_message(self, client_id: str, payload: bytes) -> None:
         try:
             payload = self._cipher.decrypt(payload).decode()
-            print(payload)
+            logging.debug(payload)
             session_id, req = parse_lua_request(payload)
             req_context = RequestContext(session_id, None, None, client_id, CommunicationType.CLOUD)
-            resp = f"resp:127.0.0.1:{hex(session_id)[2:]}:{self._request_handler(req_context, req)}" 
-            print(resp)
-            resp = self._cipher.encrypt(resp.encode())
-            
-            client.publish(topic=f"clu/{self._config.serial_number}/outbound/{client_id}", payload=resp)
+            resp = f"resp:127.0.0.1:{hex(session_id)[2:]}:{self._request_handler(req_context, req)}"
+
+            message = (client_id, resp, time.monotonic())
+            self._outbound.put((PRIORITY_RESPONSE, next(self._outbound_seq), message))
         except:
             pass
+
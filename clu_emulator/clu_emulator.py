@@ -10,6 +10,7 @@ from .clu_server import CluServer
 from .commands.simple_handler_command import SimpleHandlerCommand
 from .config import Config
 from .config_manager import ConfigManager
+from .file_store import FileStore
 from .module_manager import Module, ModuleInfo, ModuleManager
 
 
@@ -26,11 +27,12 @@ class CluEmulator:
         self.module_manager = ModuleManager(self.config)
         self.module_manager.add_module(Module(ModuleInfo(123, 21, 1, 2, 1, "1.3.13")))
 
-        self.config_manager = ConfigManager(self.config, config_dir, self.module_manager)
+        self.file_store = FileStore(config_dir)
+        self.config_manager = ConfigManager(self.config, config_dir, self.module_manager, self.file_store)
         
         project_key, project_iv = self.config_manager.load_project_key()
         
-        self.clu_server = CluServer(self.config, project_key, project_iv, config_dir)
+        self.clu_server = CluServer(self.config, project_key, project_iv, config_dir, file_store=self.file_store)
         self.clu_cloud = CloudCommunicator(self.config, self.clu_server.project_cipher)
         self.client_manager = ClientManager(self.clu_server.project_cipher, self.clu_cloud)
         self.lua_engine = CluLuaEngine(self.config, self.client_manager, self.clu_server.project_cipher, config_dir)
@@ -1,17 +1,142 @@
+import hashlib
+import logging
 import os
+import queue
+import re
+import tempfile
 import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 
 import lupa.lua53 as lupa
 
 from .cipher import CluCipher
+from .clock import ClockService
 from .client_manager import ClientManager
 from .config import Config
 from .objects.gate_object import GateObject
 from .objects.grenton_object import GrentonObject
 from .objects.objects import OBJECT_CLASS_DICT
+from .scheduler import Scheduler
 from .types import RequestContext
 from .utils import fetch_values, parse_observables_list
 
+# Only plain table constructors are accepted, so the request cannot call into
+# anything with side effects.
+FETCH_VALUES_PATTERN = re.compile(r'^SYSTEM:fetchValues\(\{[\w\s{},"\']*\}\)$')
+MAX_READ_PLANS = 256
+LUA_NAME_PATTERN = re.compile(r"[A-Za-z_]\w*")
+
+# Globals a read plan was built from are moved into a table behind the
+# metatable of _G. Reads still find them, but assigning one of them calls
+# on_rebind, so a script that rebinds an object drops the stale plans.
+WATCH_GLOBALS_LUA = """
+local watched, on_rebind = {}, ...
+setmetatable(_G, {
+    __index = watched,
+    __newindex = function(t, k, v)
+        if watched[k] ~= nil then
+            watched[k] = v
+            on_rebind()
+        else
+            rawset(t, k, v)
+        end
+    end
+})
+return function(name)
+    if watched[name] == nil then
+        watched[name] = rawget(_G, name)
+        rawset(_G, name, nil)
+    end
+end
+"""
+BYTECODE_CACHE_DIR = "luac"
+
+class LuaChunkCache:
+    
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        
+        self._chunks: OrderedDict[str, object] = OrderedDict()
+        
+    def get(self, lua: lupa.LuaRuntime, string: str):
+        chunk = self._chunks.get(string)
+        if chunk is not None:
+            self.hits += 1
+            self._chunks.move_to_end(string)
+            return chunk
+        
+        self.misses += 1
+        chunk = lua.compile(f"return tostring({string})")
+        if self.size > 0:
+            self._chunks[string] = chunk
+            if len(self._chunks) > self.size:
+                self._chunks.popitem(last=False)
+        
+        return chunk
+    
+    def clear(self) -> None:
+        self._chunks.clear()
+
+# Compiled om.lua and user.lua are kept under config_dir, so a restart with
+# unchanged files skips parsing them. Each cache file starts with a header
+# naming the lua version and the hash of the source it was compiled from,
+# anything else is stale and is compiled again from source.
+class LuaBytecodeCache:
+    
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        # Chunks are dumped by a runtime that does not decode strings, so the
+        # bytecode reaches python unchanged.
+        self._compiler = lupa.LuaRuntime(encoding=None)
+        
+        self.hits = 0
+        self.misses = 0
+    
+    def load(self, lua: lupa.LuaRuntime, name: str, source: str, digest: bytes):
+        header = f"Lua {lupa.LUA_VERSION[0]}.{lupa.LUA_VERSION[1]} {digest.hex()}\n".encode()
+        path = os.path.join(self.directory, f"{name}c")
+        
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            data = b""
+        
+        # load() returns nil and a message when the bytecode is not compatible
+        # with this build of lua.
+        if data.startswith(header):
+            chunk = lua.globals().load(data[len(header):], f"={name}", "b")
+            if lupa.lua_type(chunk) == "function":
+                self.hits += 1
+                return chunk
+        
+        self.misses += 1
+        chunk = self._compiler.globals().load(source.encode(), f"={name}".encode())
+        if lupa.lua_type(chunk) != "function":
+            return lua.compile(source) # raises the syntax error
+        
+        bytecode = self._compiler.globals().string.dump(chunk)
+        self._save(path, header + bytecode)
+        
+        return lua.globals().load(bytecode, f"={name}", "b")
+    
+    def _save(self, path: str, data: bytes) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(data)
+                os.replace(tmp_path, path)
+            except:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logging.warning(f"Cannot save lua bytecode cache {path}: {e}")
 
 class CluLuaEngine:
     
@@ -24,23 +149,112 @@ class CluLuaEngine:
         self.config_dir = config_dir
         
         self.request_lock = threading.Lock()
+        # Runs work that must not hold request_lock while waiting, e.g. async remote calls.
+        self.executor = ThreadPoolExecutor(max_workers=config.remote_workers)
+        # Shared by all timers. Expiries that run lua are handed to the
+        # callback thread, so the scheduler never waits for request_lock and
+        # a long request does not hold up the clock or other deadlines.
+        # Those expiries still run only once the request releases the lock.
+        self.scheduler = Scheduler()
+        self.clock = ClockService(self.scheduler)
+        self._callbacks: queue.SimpleQueue[tuple[Callable[..., None], tuple] | None] = queue.SimpleQueue()
+        self._callback_thread = threading.Thread(target=self._callback_loop, daemon=True)
+        self._callback_thread.start()
         self.lua: lupa.LuaRuntime = None
         self.initialized = False
         
         self.req_context = RequestContext(None, None, None, None, None)
         
+        # fetchValues requests that only reference object features are
+        # remembered as a list of (object, feature index) and answered without
+        # the lua runtime. Features are looked up on every read, as some
+        # objects add features after the plan was made.
+        self._read_plans: dict[str, list[tuple[GrentonObject, int]]] = {}
+        self._read_plan_key: str | None = None
+        self._watch_global: Callable[[str], None] | None = None
+        
+        self.chunk_cache = LuaChunkCache(config.lua_chunk_cache_size)
+        
+        # Every object created by the current lua runtime, disposed on reload.
+        self.objects: list[GrentonObject] = []
+        # Hashes of the lua files the current runtime was built from.
+        self._source_hashes: dict[str, bytes] = {}
+        self.bytecode_cache = LuaBytecodeCache(os.path.join(config_dir, BYTECODE_CACHE_DIR)) if config.lua_bytecode_cache else None
+        
         self.reload()
        
     def execute(self, request_context: RequestContext, string: str):
+        if self.config.lockless_reads:
+            plan = self._read_plans.get(string)
+            if plan is not None:
+                return f"values:{fetch_values(self._read_plan_values(plan))}"
+        
         res = "nil"
         with self.request_lock:
             self.req_context = request_context
-            res = self.lua.eval(f"tostring({string})")
+            if self.config.lockless_reads and FETCH_VALUES_PATTERN.match(string):
+                self._read_plan_key = string
+            
+            try:
+                res = self.chunk_cache.get(self.lua, string)()
+            finally:
+                self._read_plan_key = None
         return res
 
+    def run_callback(self, callback: Callable[..., None], *args) -> None:
+        with self.request_lock:
+            callback(*args)
+
+    # Runs the callback with request_lock on the callback thread, in the order the calls were made.
+    def call_soon(self, callback: Callable[..., None], *args) -> None:
+        self._callbacks.put((callback, args))
+
     def reload(self):
+        with self.request_lock:
+            self._reload()
+            
+    def close(self) -> None:
+        with self.request_lock:
+            self._dispose_objects()
+        self.scheduler.close()
+        self._callbacks.put(None)
+        self._callback_thread.join()
+        self.executor.shutdown(wait=False)
+
+    def _callback_loop(self) -> None:
+        while True:
+            item = self._callbacks.get()
+            if item is None:
+                return
+            
+            callback, args = item
+            try:
+                self.run_callback(callback, *args)
+            except Exception as e:
+                logging.error(f"Callback failed: {e}")
+
+    def _reload(self):
+        self._read_plans.clear()
+        sources = {name: self._read_source(name) for name in ("user.lua", "om.lua")}
+        hashes = {name: hashlib.sha256(source.encode()).digest() for name, source in sources.items()}
+        
+        # om.lua builds the object graph. When only user.lua changed, the
+        # objects with their timers, clients and device connections are kept
+        # and only the user variables are set again.
+        if (self.initialized and hashes["om.lua"] == self._source_hashes["om.lua"]
+                and hashes["user.lua"] != self._source_hashes["user.lua"]):
+            logging.info("Only user.lua changed, reloading user variables")
+            self._execute_source("user.lua", sources["user.lua"], hashes["user.lua"])
+            self._source_hashes = hashes
+            return
+        
         self.initialized = False
+        self._dispose_objects()
+        self.client_manager.clear()
+        self.chunk_cache.clear()
+        self.clock.clear()
         self.lua = lupa.LuaRuntime()
+        self._watch_global = self.lua.execute(WATCH_GLOBALS_LUA, self._read_plans.clear) if self.config.lockless_reads else None
         
         globals = self.lua.globals()
         globals["checkAlive"] = self._check_alive
@@ -55,39 +269,64 @@ class CluLuaEngine:
             "mqttDestroy": self._destroy_mqtt
         }
 
-        with open(os.path.join(self.config_dir, "user.lua"), "r") as file:
-            self.lua.execute(file.read())
-
-        with open(os.path.join(self.config_dir, "om.lua"), "r") as file:
-            self.lua.execute(file.read())
+        self._execute_source("user.lua", sources["user.lua"], hashes["user.lua"])
+        self._execute_source("om.lua", sources["om.lua"], hashes["om.lua"])
             
         self.clu.features[1].add_value_change_handler(self.client_manager.set_client_report_interval)
             
         self.lua.execute("SYSTEM.Init()")
+        self._source_hashes = hashes
         self.initialized = True
+    
+    def _read_source(self, name: str) -> str:
+        with open(os.path.join(self.config_dir, name), "r") as file:
+            return file.read()
+    
+    def _execute_source(self, name: str, source: str, digest: bytes) -> None:
+        if self.bytecode_cache is None:
+            self.lua.execute(source)
+            return
+        
+        self.bytecode_cache.load(self.lua, name, source, digest)()
        
     def _system_init(self):
         self.clu.fire_event(0)
     
     def _new_object(self, _, obj_class, *args) -> GrentonObject:
-        obj = OBJECT_CLASS_DICT.get(obj_class, None)
-        if obj:
-            return obj(self, args)
+        obj_class = OBJECT_CLASS_DICT.get(obj_class, GrentonObject) # unknown classes get a dummy object
+        obj = obj_class(self, args)
+        self.objects.append(obj)
         
-        return GrentonObject(self, args) # return dummy object
+        return obj
 
     def _new_gate(self, _, *args) -> GrentonObject:
         if len(args) == 2:
             obj_class = args[0]
             return self._new_object(None, obj_class, args[1:])
 
-        return GateObject(self, ())
+        obj = GateObject(self, ())
+        self.objects.append(obj)
+        
+        return obj
+    
+    # Objects of the previous runtime must not keep timers, callbacks or
+    # remote registrations alive, nor keep the old runtime from being freed.
+    def _dispose_objects(self) -> None:
+        for obj in self.objects:
+            obj.dispose()
+        self.objects.clear()
+        self.clu = None
     
     def _check_alive(self):
         return hex(self.config.serial_number)[2:]
     
     def _fetch_values(self, _, obs) -> str:
         objects = parse_observables_list(obs)
+        
+        if self._read_plan_key and len(self._read_plans) < MAX_READ_PLANS:
+            if not any(isinstance(obj, str) for obj in objects):
+                self._add_read_plan(self._read_plan_key, obs)
+            self._read_plan_key = None
     
         values = []
         for obj in objects:
@@ -98,6 +337,20 @@ class CluLuaEngine:
         
         return f"values:{fetch_values(values)}"
     
+    def _add_read_plan(self, key: str, obs) -> None:
+        for name in LUA_NAME_PATTERN.findall(key):
+            self._watch_global(name)
+        
+        self._read_plans[key] = [tuple(elm.values()) for elm in obs.values()]
+    
+    def _read_plan_values(self, plan: list[tuple[GrentonObject, int]]) -> list:
+        values = []
+        for obj, index in plan:
+            feature = obj.features.get(index)
+            values.append(None if feature is None else feature.get_value())
+        
+        return values
+    
     def _register_client(self, _, ip, port, client_id, obs) -> str:
         objects = parse_observables_list(obs)
     
@@ -1,17 +1,20 @@
 
+import asyncio
 import base64
 import logging
 import re
 import socket
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Callable
 
 from .cipher import CluCipher
 from .commands.command import CLUCommand
 from .commands.simple_handler_command import SimpleHandlerCommand
 from .config import Config
+from .file_store import FileStore
 from .tftpy.TftpServer import TftpServer
-from .types import CommunicationType, RequestContext
+from .types import CommunicationType, PacketType, RequestContext
 from .utils import hash_function, key_derivation, parse_lua_request
 
 GRENTON_KEY = "hd5SHpxl0N5+WEXTXlPQmw=="
@@ -19,6 +22,34 @@ GRENTON_IV = "BwYFBAMCAQAEAgkDBAEFBw=="
 
 LUA_REQUEST_PATTERN = re.compile(r"^req:(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3}):[a-fA-F\d]{1,16}:.*")
 TFTP_PATH_PATTERN = re.compile(r"^[aAmM]:\\\\.*")
+PRINTABLE_PATTERN = re.compile(rb"[\x20-\x7e]*")
+
+# Discovery and key set packets are "<token:32>:<iv:16>:<command>", so the
+# 4th block always starts with the last byte of the iv followed by ":req_".
+COMMAND_BLOCK_INDEX = 3
+DISCOVERY_PREFIX = b":req_discovery"
+PRIVATE_PREFIX = b":req_set_"
+SET_CLU_IP_PREFIX = b"req_set_clu_ip"
+
+def _log_exceptions(handler: Callable[..., None], *args) -> None:
+    try:
+        handler(*args)
+    except Exception as e:
+        logging.error(e)
+
+class CluDatagramProtocol(asyncio.DatagramProtocol):
+    
+    def __init__(self, server: "CluServer") -> None:
+        self.server = server
+        
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            self.server._handle_packet(data, addr)
+        except Exception as e:
+            logging.error(e)
+            
+    def error_received(self, exc: Exception) -> None:
+        logging.error(exc)
     
 class CluServer:
     
@@ -31,7 +62,8 @@ class CluServer:
         project_key: bytes = bytes(16),
         project_iv: bytes =  bytes(16),
         config_dir: str = "config",
-        hostip: str = ""
+        hostip: str = "",
+        file_store: FileStore | None = None
     ) -> None:
         self.config = config
 
@@ -53,9 +85,28 @@ class CluServer:
         self.project_cipher = CluCipher(self.project_key, self.project_iv)
         
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.listener_thread= threading.Thread(target=self._listener_loop, daemon=True)
         
-        self.tftp = TftpServer(config_dir)
+        # In asyncio mode packets are received on an event loop and lua requests
+        # and clu commands are handed off to a worker pool, so a slow request
+        # does not hold up discovery or key changes.
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._transport: asyncio.DatagramTransport | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        
+        if config.async_server:
+            self._loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(max_workers=config.server_workers)
+            self.listener_thread = threading.Thread(target=self._async_listener_loop, daemon=True)
+        else:
+            self.listener_thread = threading.Thread(target=self._listener_loop, daemon=True)
+        
+        # Generated files are served and uploads are received in memory.
+        self.file_store = file_store or FileStore(config_dir)
+        self.tftp = TftpServer(
+            config_dir,
+            dyn_file_func=self.file_store.open_download,
+            upload_open=self.file_store.open_upload
+        )
         self.tftp_thread = None
         self.tftp_running = False
 
@@ -69,7 +120,13 @@ class CluServer:
         self.listener_thread.start()
         
     def close(self) -> None:
-        self.sock.close()
+        if self._loop:
+            if self._transport:
+                self._loop.call_soon_threadsafe(self._transport.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._executor.shutdown(wait=False)
+        else:
+            self.sock.close()
         self.stop_ftp()
         
     def start_ftp(self) -> None:
@@ -105,37 +162,93 @@ class CluServer:
         while True:
             try:
                 data, sender_addr = self.sock.recvfrom(1024)
+                self._handle_packet(data, sender_addr)
+            except Exception as e:
+                logging.error(e)
+
+    def _async_listener_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._transport, _ = self._loop.run_until_complete(
+            self._loop.create_datagram_endpoint(lambda: CluDatagramProtocol(self), sock=self.sock)
+        )
+        self._loop.run_forever()
+
+    def _handle_packet(self, data: bytes, sender_addr) -> None:
+        # Nearly all packets are lua requests and commands, so the project
+        # key is tried first and only the rest is classified by block peeks.
+        msg = self._decrypt_project_packet(data)
+        packet_type = PacketType.PROJECT if msg is not None else self._classify_packet(data)
+        
+        try:
+            if packet_type == PacketType.PROJECT:
+                if LUA_REQUEST_PATTERN.match(msg):
+                    self._dispatch(self._handle_lua_request, msg, sender_addr)
+                else:
+                    self._dispatch(self._handle_clu_command, msg, sender_addr)
+                    
+            elif packet_type == PacketType.DISCOVERY:
+                msg = self.grenton_cipher.decrypt(data)
+                self._handle_clu_discovery(msg, sender_addr)
                 
-                try:
-                    msg = self.project_cipher.decrypt(data).decode().strip()
+            elif packet_type == PacketType.PRIVATE:
+                msg = self.private_cipher.decrypt(data)
+                if msg.startswith(SET_CLU_IP_PREFIX):
+                    print(f"Recieved ip change request from {sender_addr[0]}:{sender_addr[1]}")
+                    print("Ignoring. (Sending garbage as OM only checks the begining of the response)")
                     
-                    if LUA_REQUEST_PATTERN.match(msg):
-                        self._handle_lua_request(msg, sender_addr)
-                        
-                    else:
-                        self._handle_clu_command(msg, sender_addr)
-                        
-                except:
-                    try:
-                        msg = self.grenton_cipher.decrypt(data)
-                        self._handle_clu_discovery(msg, sender_addr)
-                        
-                    except:
-                        try:
-                            msg = self.private_cipher.decrypt(data)
-                            if msg.startswith(b"req_set_clu_ip"):
-                                print(f"Recieved ip change request from {sender_addr[0]}:{sender_addr[1]}")
-                                print("Ignoring. (Sending garbage as OM only checks the begining of the response)")
-                                
-                                self.sock.sendto(self.private_cipher.encrypt(b"resp_set_clu_ip:Lorem_ipsum_dolor_sit_amet"), sender_addr)
-                                continue
-                            
-                            self._handle_set_key(msg, sender_addr)
-                        except:
-                            pass
+                    self._send(self.private_cipher.encrypt(b"resp_set_clu_ip:Lorem_ipsum_dolor_sit_amet"), sender_addr)
+                    return
                 
-            except Exception as e:
-                logging.error(e)
+                self._handle_set_key(msg, sender_addr)
+                
+            else:
+                logging.debug(f"Unknown packet from {sender_addr[0]}:{sender_addr[1]}")
+        except ValueError:
+            logging.debug(f"Malformed {packet_type.value} packet from {sender_addr[0]}:{sender_addr[1]}")
+
+    def _decrypt_project_packet(self, data: bytes) -> str | None:
+        try:
+            msg = self.project_cipher.decrypt(data).strip()
+        except ValueError:
+            return None
+        
+        # Packets for other keys still unpad now and then, but do not start with text.
+        if not PRINTABLE_PATTERN.fullmatch(msg, 0, 16):
+            return None
+        
+        try:
+            return msg.decode()
+        except UnicodeDecodeError:
+            return None
+
+    def _classify_packet(self, data: bytes) -> PacketType:
+        if len(data) == 0 or len(data) % 16 != 0:
+            return PacketType.UNKNOWN
+        
+        if len(data) > COMMAND_BLOCK_INDEX * 16:
+            if self.grenton_cipher.decrypt_block(data, COMMAND_BLOCK_INDEX)[1:].startswith(DISCOVERY_PREFIX):
+                return PacketType.DISCOVERY
+            
+            if self.private_cipher.decrypt_block(data, COMMAND_BLOCK_INDEX)[1:].startswith(PRIVATE_PREFIX):
+                return PacketType.PRIVATE
+        
+        if self.private_cipher.decrypt_block(data).startswith(SET_CLU_IP_PREFIX):
+            return PacketType.PRIVATE
+        
+        return PacketType.UNKNOWN
+
+    def _dispatch(self, handler: Callable[..., None], *args) -> None:
+        if self._executor is None:
+            handler(*args)
+            return
+        
+        self._executor.submit(_log_exceptions, handler, *args)
+
+    def _send(self, data: bytes, addr) -> None:
+        if self._transport is None:
+            self.sock.sendto(data, addr)
+        else:
+            self._loop.call_soon_threadsafe(self._transport.sendto, data, addr)
          
     def _change_project_key(self, key, iv):
         self.project_key = key
@@ -154,11 +267,11 @@ class CluServer:
         if self.lua_handler:
             req_context = RequestContext(session_id, sender_addr[0], sender_addr[1], None, CommunicationType.LOCAL)
             resp = self.lua_handler(req_context, payload)
-            resp_message = f"resp:{self.hostip}:{session_id}:{resp}"
+            resp_message = f"resp:{self.hostip}:{hex(session_id)[2:]}:{resp}"
             
             print(f"Sending response to {sender_addr[0]}:{sender_addr[1]}")
             print(f"Response payload: {resp}")
-            self.sock.sendto(self.project_cipher.encrypt(resp_message.encode()), sender_addr)
+            self._send(self.project_cipher.encrypt(resp_message.encode()), sender_addr)
         
         else:
             print("Ignoring request.")
@@ -185,7 +298,7 @@ class CluServer:
         
         logging.info(f"Sending respnese to {return_addr[0]}:{return_addr[1]}")
         logging.info(f"Response: {resp}")
-        self.sock.sendto(self.project_cipher.encrypt(resp.encode()), return_addr)
+        self._send(self.project_cipher.encrypt(resp.encode()), return_addr)
        
     def _handle_clu_discovery(self, payload: bytes, return_addr):
         token = payload[:32]
@@ -200,8 +313,6 @@ class CluServer:
         
         print(f"Received clu discovery request from {return_addr[0]}:{return_addr[1]}")
         
-        sender_cipher = CluCipher(GRENTON_KEY, sender_iv)
-        
         try:
             token = self.project_cipher.decrypt(token)
             token = hash_function(token)
@@ -213,9 +324,9 @@ class CluServer:
         
         response_payload = token + b":" + self.clu_iv + part2
         
-        encrypted = sender_cipher.encrypt(response_payload)
+        encrypted = self.grenton_cipher.encrypt(response_payload, sender_iv)
 
-        self.sock.sendto(encrypted, return_addr)
+        self._send(encrypted, return_addr)
         print(f"Sending clu discovery reponse to {return_addr[0]}")
         
     def _handle_set_key(self, payload: bytes, return_addr):
@@ -232,5 +343,5 @@ class CluServer:
         key = payload[i+1:-2]
         
         self._change_project_key(key, iv)
-        self.sock.sendto(self.project_cipher.encrypt(b"resp:OK"), return_addr)
+        self._send(self.project_cipher.encrypt(b"resp:OK"), return_addr)
         
\ No newline at end of file
@@ -19,4 +19,17 @@ class Config:
 
     clu_iv: str = "AAAAAAAAAAAAAAAAAAAAAA=="
 
+    async_server: bool = False
+    server_workers: int = 8
+
+    lockless_reads: bool = False
+    lua_chunk_cache_size: int = 128
+    lua_bytecode_cache: bool = True
+    remote_workers: int = 4
+    remote_cache_ttl: int = 0
+
+    cloud_workers: int = 4
+    cloud_queue_size: int = 1024
+    cloud_pending_size: int = 256
+
 
@@ -5,15 +5,17 @@ import os
 from typing import Any
 
 from .config import Config
+from .file_store import FileStore
 from .module_manager import ModuleManager, Module
 from .utils import padd_string
 
 class ConfigManager:
 
-    def __init__(self, config: Config, config_dir, module_manager: ModuleManager) -> None:
+    def __init__(self, config: Config, config_dir, module_manager: ModuleManager, file_store: FileStore) -> None:
         self.config = config
         self.config_dir = config_dir
         self.module_manager = module_manager
+        self.file_store = file_store
 
         self.generate_config_files()
 
@@ -34,8 +36,7 @@ class ConfigManager:
         for line in {self._module_to_txt(mod) for mod in modules}:
             lines.append(line)
 
-        with open(os.path.join(self.config_dir, "config.txt"), "w+") as f:
-            f.writelines([line + "\n" for line in lines])
+        self.file_store.put("config.txt", "".join([line + "\n" for line in lines]))
 
     def _module_to_txt(self, module: Module):
         info = module.module_info
@@ -59,8 +60,7 @@ class ConfigManager:
         data["tfbusDevices"] = [self._module_to_json(mod) for mod in modules]
         data["zwaveDevices"] = []
 
-        with open(os.path.join(self.config_dir, "config.json"), "w+") as f:
-            json.dump(data, f)
+        self.file_store.put("config.json", json.dumps(data))
 
     def _module_to_json(self, module: Module) -> dict[str, Any]:
         info = module.module_info
@@ -0,0 +1,88 @@
+import io
+import logging
+import os
+import tempfile
+import threading
+
+
+# Files served over TFTP from memory. Generated files (config.json,
+# config.txt, measurements) never touch the disk. Uploaded files are
+# kept in memory and written to config_dir atomically once the transfer
+# completes, so a broken upload never leaves a half written om.lua behind.
+class FileStore:
+
+    def __init__(self, config_dir: str) -> None:
+        self.config_dir = os.path.abspath(config_dir)
+
+        self._files: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def put(self, name: str, data: bytes | str) -> None:
+        if isinstance(data, str):
+            data = data.encode()
+
+        with self._lock:
+            self._files[self._key(name)] = data
+
+    def get(self, name: str) -> bytes | None:
+        with self._lock:
+            return self._files.get(self._key(name))
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._files.pop(self._key(name), None)
+
+    # TftpServer dyn_file_func
+    def open_download(self, filename: str, **kwargs) -> io.BytesIO | None:
+        data = self.get(filename)
+        if data is None:
+            return None
+
+        # BytesIO shares the bytes object until it is written to.
+        return io.BytesIO(data)
+
+    # TftpServer upload_open
+    def open_upload(self, path: str, context) -> io.BytesIO | None:
+        name = os.path.relpath(path, self.config_dir)
+        if name.startswith(".."):
+            return None
+
+        return _Upload(self, name, context)
+
+    def commit(self, name: str, data: bytes) -> None:
+        self.put(name, data)
+
+        path = os.path.join(self.config_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    def _key(self, name: str) -> str:
+        return name.replace("\\", "/").lstrip("/").lower()
+
+class _Upload(io.BytesIO):
+
+    def __init__(self, store: FileStore, name: str, context) -> None:
+        super().__init__()
+        self._store = store
+        self._name = name
+        self._context = context
+
+    # The tftp context closes the file when the session ends, successful or
+    # not. Only a finished transfer (no state left) is committed.
+    def close(self) -> None:
+        if not self.closed and self._context.state is None:
+            try:
+                self._store.commit(self._name, self.getvalue())
+            except OSError as e:
+                logging.error(f"Cannot save uploaded file {self._name}: {e}")
+        super().close()
@@ -18,7 +18,7 @@ class Feature:
             self.value = value
         
             if prev_value != value:
-                for handler in self._update_handlers:
+                for handler in list(self._update_handlers):
                     handler(value)
     
     def get_value(self) -> Any:
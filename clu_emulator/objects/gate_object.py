@@ -1,41 +1,53 @@
 
 import time
-from threading import Thread
 
 from .grenton_object import Feature, GrentonObject
 
 
-class UptimeFeature(Feature):
+class ClockFeature(Feature):
     
-    def __init__(self) -> None:
+    def __init__(self, clock) -> None:
         super().__init__(int, True, False)
         
-        self._start_timestamp = time.time()
+        clock.add_feature(self)
         
-        self._thread = Thread(target=self.update_time_loop, daemon=True)
-        self._thread.start()
+    # Watched features return the value of the last tick, so a report never
+    # carries a value the change detection has not seen yet.
+    def get_value(self) -> int:
+        if self._update_handlers:
+            return self.value
         
-    def update_time_loop(self):
-        while True:
-            t = time.perf_counter()
-            self.set_value(int(time.time() - self._start_timestamp))
-            t = time.perf_counter() - t
+        return self.current_value()
+    
+    def add_value_change_handler(self, handler) -> None:
+        if not self._update_handlers:
+            self.value = self.current_value()
+        
+        super().add_value_change_handler(handler)
+    
+    def tick(self) -> None:
+        if self._update_handlers:
+            self.set_value(self.current_value(), True)
             
-            if t < 1:
-                time.sleep(1 - t)
-
-class UnixTimeFeature(Feature):
+    def current_value(self) -> int:
+        raise NotImplementedError
 
-    def __init__(self) -> None:
-        super().__init__(int, True, False, None)
+class UptimeFeature(ClockFeature):
+    
+    def __init__(self, clock) -> None:
+        # Started at the last whole unix second, so uptime counts up together
+        # with the unix time, right when the clock ticks.
+        self._start_timestamp = time.monotonic() - time.time() % 1
+        
+        super().__init__(clock)
+        
+    def current_value(self) -> int:
+        return int(time.monotonic() - self._start_timestamp)
 
-        self.update_thread = Thread(target=self.update_time, daemon=True)
-        self.update_thread.start()
+class UnixTimeFeature(ClockFeature):
 
-    def update_time(self):
-        while True:
-            self.set_value(int(time.time()))
-            time.sleep(1)
+    def current_value(self) -> int:
+        return int(time.time())
 
 class GateObject(GrentonObject):
     
@@ -44,9 +56,9 @@ class GateObject(GrentonObject):
 
         engine.clu = self
         
-        self.features[0] = UptimeFeature() # uptime
+        self.features[0] = UptimeFeature(engine.clock) # uptime
         self.features[1] = Feature(bool)   # client report interval
         self.features[2] = Feature(str)    # primary DNS
         self.features[3] = Feature(str)    # secondary DNS
 
-        self.features[15] = UnixTimeFeature()
\ No newline at end of file
+        self.features[15] = UnixTimeFeature(engine.clock)
\ No newline at end of file
@@ -48,10 +48,19 @@ class GrentonObject:
         if handlers:
             for handler in handlers:
                 handler()
+                
+    # Called when the lua runtime that created the object is thrown away.
+    # Event handlers are lua functions, dropping them breaks the reference
+    # cycle between the object and the old runtime.
+    def dispose(self) -> None:
+        self.event_handlers.clear()
 
 class ModuleObject:
     
     def __init__(self, engine, args) -> None:
         self.engine = engine
         self.serial_number = args[0]
-        self.module_type = args[1]
\ No newline at end of file
+        self.module_type = args[1]
+        
+    def dispose(self) -> None:
+        pass
\ No newline at end of file
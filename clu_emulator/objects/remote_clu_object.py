@@ -1,10 +1,63 @@
 
+import logging
+import threading
+import time
 from typing import Any
 
-from ..clu_client import CluClient
+from ..clu_client import get_clu_client
 from ..utils import int_to_ip
+from .feature import Feature
 from .grenton_object import GrentonObject
 
+# Values pushed by the remote CLU are stored in features starting at this index.
+SUBSCRIPTION_FEATURE_OFFSET = 10
+
+
+class RemoteResultCache:
+    
+    def __init__(self) -> None:
+        self._entries: dict[str, tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.total_staleness = 0.0
+        self.max_staleness = 0.0
+        
+    def get(self, expression: str, ttl: float) -> tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(expression)
+            if entry is not None:
+                age = time.monotonic() - entry[1]
+                if age < ttl:
+                    self.hits += 1
+                    self.total_staleness += age
+                    self.max_staleness = max(self.max_staleness, age)
+                    return True, entry[0]
+                
+            self.misses += 1
+            return False, None
+        
+    def put(self, expression: str, value: Any) -> None:
+        with self._lock:
+            self._entries[expression] = (value, time.monotonic())
+            
+    # Updates an entry only if the expression is already cached.
+    def refresh(self, expression: str, value: Any) -> None:
+        with self._lock:
+            if expression in self._entries:
+                self._entries[expression] = (value, time.monotonic())
+        
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def average_staleness(self) -> float:
+        return self.total_staleness / self.hits if self.hits else 0.0
 
 class RemoteCluObject(GrentonObject):
     
@@ -12,9 +65,120 @@ class RemoteCluObject(GrentonObject):
         super().__init__(engine, args)
         
         self.ip = int_to_ip(args[0])
-        self.clu_client = CluClient(self.ip, self.engine.cipher, timeout=0.2)
+        self.clu_client = get_clu_client(self.ip, self.engine.cipher, timeout=0.2)
+        
+        self.cache = RemoteResultCache()
+        self.subscription: tuple[int, list[str]] | None = None
+        
+        self.features[0] = Feature(None, settable=False) # result of the last async request
+        self.features[1] = Feature(float, settable=False, initial_value=0.0) # cache hit rate
+        self.features[2] = Feature(float, settable=False, initial_value=0.0) # average age of cached results served [ms]
         
         self.methods[0] = self._send_request
+        self.methods[1] = self._send_request_async
+        self.methods[2] = self._send_batch_request
+        self.methods[3] = self._send_cached_request
+        self.methods[4] = self._subscribe
+        self.methods[5] = self._unsubscribe
         
+    # Arbitrary requests may change the remote state, so they drop cached results.
     def _send_request(self, payload: str) -> Any:
-        return self.clu_client.send_lua_request(payload)
\ No newline at end of file
+        self.cache.invalidate()
+        return self._to_lua(self.clu_client.send_lua_request(payload))
+    
+    # Read-through cache, results younger than ttl [ms] are returned without a round trip.
+    def _send_cached_request(self, expression: str, ttl: float | None = None) -> Any:
+        if ttl is None:
+            ttl = self.engine.config.remote_cache_ttl
+        
+        hit, value = self.cache.get(expression, ttl / 1000)
+        if not hit:
+            value = self.clu_client.send_lua_request(expression)
+            self.cache.put(expression, value)
+            
+        self.features[1].set_value(self.cache.hit_rate(), True)
+        self.features[2].set_value(self.cache.average_staleness() * 1000, True)
+        
+        return self._to_lua(value)
+    
+    # Takes a table of expressions and returns a table with their values.
+    def _send_batch_request(self, expressions) -> Any:
+        values = self.clu_client.send_lua_batch(list(expressions.values()))
+        return self.engine.lua.table_from(values, recursive=True)
+    
+    # Returns immediately, the result is stored in feature 0 and
+    # event 0 (result) or 1 (error) is fired once the remote CLU answers.
+    def _send_request_async(self, payload: str) -> None:
+        self.cache.invalidate()
+        self.engine.executor.submit(self._async_request, payload)
+        
+    def _async_request(self, payload: str) -> None:
+        try:
+            result = self.clu_client.send_lua_request(payload)
+        except Exception:
+            self.engine.run_callback(self.fire_event, 1)
+            return
+        
+        self.engine.run_callback(self._deliver_result, result)
+        
+    def _deliver_result(self, result: Any) -> None:
+        self.features[0].set_value(self._to_lua(result), True)
+        self.fire_event(0)
+        
+    # Takes a table of remote observables, user variable names or "{OBJ, index}"
+    # strings. The remote CLU pushes their values on change, they can be read
+    # from features SUBSCRIPTION_FEATURE_OFFSET + n and fire event 2.
+    def _subscribe(self, observables) -> None:
+        self._unsubscribe()
+        
+        names = list(observables.values())
+        for i in range(len(names)):
+            self.features[SUBSCRIPTION_FEATURE_OFFSET + i] = Feature(None, settable=False)
+        
+        table = ", ".join(name if name.startswith("{") else f'"{name}"' for name in names)
+        client_id = self.clu_client.register_client(f"{{{table}}}", self._report_received)
+        self.subscription = (client_id, names)
+        
+    def _unsubscribe(self) -> None:
+        if self.subscription is None:
+            return
+        
+        client_id, names = self.subscription
+        self.subscription = None
+        for i in range(len(names)):
+            self.features.pop(SUBSCRIPTION_FEATURE_OFFSET + i, None)
+            
+        self.clu_client.destroy_client(client_id)
+        
+    # Called on the client's receiver thread, which must not wait for the lua lock.
+    def _report_received(self, values: list[Any]) -> None:
+        self.engine.executor.submit(self.engine.run_callback, self._deliver_report, values)
+        
+    def _deliver_report(self, values: list[Any]) -> None:
+        if self.subscription is None:
+            return
+        
+        for i, (name, value) in enumerate(zip(self.subscription[1], values)):
+            feature = self.features.get(SUBSCRIPTION_FEATURE_OFFSET + i)
+            if feature:
+                feature.set_value(value, True)
+            if not name.startswith("{"):
+                self.cache.refresh(name, value)
+            
+        self.fire_event(2)
+        
+    def dispose(self) -> None:
+        try:
+            self._unsubscribe()
+        except Exception as e:
+            logging.warning(f"Cannot destroy client registration on {self.ip}: {e}")
+        
+        self.cache.invalidate()
+        self.features[0].set_value(None, True)
+        
+        super().dispose()
+        
+    def _to_lua(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            return self.engine.lua.table_from(value, recursive=True)
+        return value
@@ -43,6 +43,11 @@ class RollerShutterObject(GrentonObject):
 
         self.update_position()
         
+    def dispose(self) -> None:
+        self.device.unregister_device_updated_cb(self.update_callback)
+        
+        super().dispose()
+        
     def update_callback(self, device):
         self.update_position()
 
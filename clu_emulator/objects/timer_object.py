@@ -1,13 +1,14 @@
 
-from threading import Timer
+import time
 
+from ..scheduler import ScheduledCall
 from .feature import Feature
 from .grenton_object import GrentonObject
 
 
 class TimerObject(GrentonObject):
     
-    timer: Timer | None = None
+    timer: ScheduledCall | None = None
     
     def __init__(self, engine, args) -> None:
         super().__init__(engine, args)
@@ -15,31 +16,57 @@ class TimerObject(GrentonObject):
         self.features[0] = Feature(int)
         self.features[1] = Feature(int)
         self.features[2] = Feature(int, settable=False)
-
+        
         self.features[2].set_value(0, True)
         
         self.methods[0] = self.start
         self.methods[1] = self.stop
         
+        # Bumped on every start and stop, so an expiry that was already
+        # waiting for the lua lock can tell it is no longer wanted.
+        self._generation = 0
+    
     def start(self) -> None:
+        self._start(time.monotonic() + self.features[0].get_value() / 1000)
+    
+    def _start(self, deadline: float) -> None:
         if self.timer:
             self.timer.cancel()
-        self.timer = Timer(self.features[0].get_value() / 1000, self.on_timer)
+        
+        self._generation += 1
+        self.timer = self.engine.scheduler.call_at(deadline, self.engine.call_soon, self.on_timer, self._generation)
         self.features[2].set_value(1, True)
-        self.timer.start()
         
         self.fire_event(1)
-        
+    
     def stop(self) -> None:
         if self.timer:
             self.timer.cancel()
+        self._generation += 1
         self.features[2].set_value(0, True)
         
         self.fire_event(2)
     
-    def on_timer(self) -> None:
+    def dispose(self) -> None:
+        if self.timer:
+            self.timer.cancel()
+        self._generation += 1
+        
+        super().dispose()
+    
+    def on_timer(self, generation: int) -> None:
+        if generation != self._generation:
+            return
+        
+        deadline = self.timer.deadline
         self.features[2].set_value(0, True)
         self.fire_event(0)
         
-        if self.get(1) == 1:
-            self.start()
\ No newline at end of file
+        # Cyclic timers are rescheduled from the previous deadline, so they do
+        # not drift. A timer that fell more than a period behind starts over.
+        if self.get(1) == 1 and generation == self._generation:
+            deadline += self.features[0].get_value() / 1000
+            if deadline < time.monotonic():
+                self.start()
+            else:
+                self._start(deadline)
@@ -0,0 +1,88 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+
+class ScheduledCall:
+
+    def __init__(self, deadline: float, callback: Callable[..., Any], args: tuple) -> None:
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+# Runs timed callbacks for all objects on a single thread. Calls are kept in
+# a heap ordered by their monotonic deadline; cancelled calls stay in the heap
+# and are skipped when they come up.
+class Scheduler:
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, ScheduledCall]] = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def call_at(self, deadline: float, callback: Callable[..., Any], *args) -> ScheduledCall:
+        call = ScheduledCall(deadline, callback, args)
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._seq), call))
+            # Only a new earliest deadline changes how long the thread sleeps.
+            if self._heap[0][2] is call:
+                self._condition.notify()
+
+        return call
+
+    def call_later(self, delay: float, callback: Callable[..., Any], *args) -> ScheduledCall:
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def pending(self) -> int:
+        with self._condition:
+            return sum(1 for _, _, call in self._heap if not call.cancelled)
+
+    def close(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._heap.clear()
+            self._condition.notify()
+        self._thread.join()
+
+    def _loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+
+                if self._stopped:
+                    return
+
+                now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, call = heapq.heappop(self._heap)
+                    if not call.cancelled:
+                        due.append(call)
+
+            # Callbacks run without the lock, so they can schedule new calls.
+            for call in due:
+                if call.cancelled:
+                    continue
+                try:
+                    call.callback(*call.args)
+                except Exception as e:
+                    logging.error(f"Scheduled call failed: {e}")
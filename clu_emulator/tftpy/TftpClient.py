@@ -32,6 +32,11 @@ class TftpClient(TftpSession):
             tftpassert(int == type(size), "blksize must be an int")
             if size < MIN_BLKSIZE or size > MAX_BLKSIZE:
                 raise TftpException("Invalid blksize: %d" % size)
+        if "windowsize" in self.options:
+            size = self.options["windowsize"]
+            tftpassert(int == type(size), "windowsize must be an int")
+            if size < MIN_WINDOWSIZE or size > MAX_WINDOWSIZE:
+                raise TftpException("Invalid windowsize: %d" % size)
 
     def download(
         self,
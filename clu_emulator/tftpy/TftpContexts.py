@@ -111,16 +111,32 @@ class TftpContext:
         self.last_update = 0
         # The last packet we sent, if applicable, to make resending easy.
         self.last_pkt = None
+        # Reused buffer for outgoing DAT packets, header included. It holds
+        # one slot per block of the window, used round robin.
+        self.dat_buffer = None
+        self.dat_slot = 0
+        # DAT packets sent but not acknowledged yet (RFC 7440 windowsize).
+        self.window = []
+        # In-order DAT packets received since our last ACK, and whether the
+        # current gap in received blocks was already reported.
+        self.window_received = 0
+        self.window_gap = False
         # Count the number of retry attempts.
         self.retry_count = 0
         # Flag to signal timeout error when waiting for ACK of the current block
         # and at the same time receiving duplicate ACK of previous block
         self.timeout_expectACK = False
+        # Deadline of the pending timeout check, kept by the server.
+        self.timeout_deadline = None
 
     def getBlocksize(self):
         """Fetch the current blocksize for this session."""
         return int(self.options.get("blksize", 512))
 
+    def getWindowsize(self):
+        """Fetch the current windowsize for this session."""
+        return int(self.options.get("windowsize", DEF_WINDOWSIZE))
+
     def __del__(self):
         """Simple destructor to try to call housekeeping in the end method if
         not called explicitly. Leaking file descriptors is not a good
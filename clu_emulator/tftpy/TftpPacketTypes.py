@@ -306,8 +306,10 @@ class TftpPacketDAT(TftpPacket):
         if len(self.data) == 0:
             log.debug("Encoding an empty DAT packet")
         data = self.data
-        if not isinstance(self.data, bytes):
+        if isinstance(self.data, str):
             data = self.data.encode("ascii")
+        elif not isinstance(self.data, bytes):
+            data = bytes(self.data)
         fmt = b"!HH%ds" % len(data)
         self.buffer = struct.pack(fmt, self.opcode, self.blocknumber, data)
         return self
@@ -505,6 +507,16 @@ class TftpPacketOACK(TftpPacket, TftpPacketWithOptions):
                     size = int(self.options[name])
                     if size < 0:
                         raise TftpException("Negative file sizes not supported")
+                elif name == "windowsize":
+                    # The server may only lower the requested window.
+                    size = int(self.options[name])
+                    if size >= MIN_WINDOWSIZE and size <= int(options[name]):
+                        log.debug("negotiated windowsize of %d blocks", size)
+                        options["windowsize"] = size
+                    else:
+                        raise TftpException(
+                            "windowsize %s option outside allowed range" % size
+                        )
                 else:
                     raise TftpException("Unsupported option: %s" % name)
         return True
@@ -5,13 +5,14 @@ requests. Logging is performed via a standard logging object set in
 TftpShared."""
 
 
+import heapq
+import itertools
 import logging
 import os
-import select
+import selectors
 import socket
 import threading
 import time
-from errno import EINTR
 
 from .TftpContexts import TftpContextServer
 from .TftpPacketFactory import TftpPacketFactory
@@ -29,9 +30,9 @@ class TftpServer(TftpSession):
     write them to.
 
     dyn_file_func is a callable that takes a requested download
-    path that is not present on the file system and must return either a
-    file-like object to read from or None if the path should appear as not
-    found. This permits the serving of dynamic content.
+    path and must return either a file-like object to read from or None to
+    fall back to the file system. It is consulted before the file system.
+    This permits the serving of dynamic content.
 
     upload_open is a callable that is triggered on every upload with the
     requested destination path and server context. It must either return a
@@ -48,6 +49,10 @@ class TftpServer(TftpSession):
         # A dict of sessions, where each session is keyed by a string like
         # ip:tid for the remote end.
         self.sessions = {}
+        # The selector over the main and session sockets, and the heap of
+        # pending session timeouts. Both are set up by listen().
+        self.selector = None
+        self.timeouts = []
         # A threading event to help threads synchronize with the server
         # is_running state.
         self.is_running = threading.Event()
@@ -104,52 +109,55 @@ class TftpServer(TftpSession):
 
         self.is_running.set()
 
+        # Sockets are registered with the key of their session, so ready
+        # sockets map straight to their owner. Timeouts are tracked in a heap
+        # of (deadline, seq, key, session) entries; entries of finished or
+        # replaced sessions are skipped when popped.
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ, None)
+        self.timeouts = []
+        self.timeout_seq = itertools.count()
+
         log.info("Starting receive loop...")
         while True:
             log.debug("shutdown_immediately is %s" % self.shutdown_immediately)
             log.debug("shutdown_gracefully is %s" % self.shutdown_gracefully)
             if self.shutdown_immediately:
                 log.info("Shutting down now. Session count: %d" % len(self.sessions))
+                self.selector.close()
                 self.sock.close()
                 for key in self.sessions:
                     log.warning("Forcefully closed session with %s" %
                         self.sessions[key].host)
                     self.sessions[key].end()
-                self.sessions = []
+                self.sessions = {}
                 break
 
             elif self.shutdown_gracefully:
                 if not self.sessions:
                     log.info("In graceful shutdown mode and all "
                              "sessions complete.")
+                    self.selector.close()
                     self.sock.close()
                     break
 
-            # Build the inputlist array of sockets to select() on.
-            inputlist = [self.sock]
-            for key in self.sessions:
-                inputlist.append(self.sessions[key].sock)
-
-            # Block until some socket has input on it.
-            log.debug("Performing select on this inputlist: %s", inputlist)
+            # Block until some socket has input on it or the next session
+            # times out.
+            wait = timeout
+            if self.timeouts:
+                wait = min(timeout, max(0, self.timeouts[0][0] - time.time()))
             try:
-                readyinput, readyoutput, readyspecial = select.select(
-                    inputlist, [], [], timeout
-                )
-            except OSError as err:
-                if err[0] == EINTR:
-                    # Interrupted system call
-                    log.debug("Interrupted syscall, retrying")
-                    continue
-                else:
-                    raise
+                ready = self.selector.select(wait)
+            except InterruptedError:
+                log.debug("Interrupted syscall, retrying")
+                continue
 
             deletion_list = []
 
             # Handle the available data, if any. Maybe we timed-out.
-            for readysock in readyinput:
+            for selkey, _ in ready:
                 # Is the traffic on the main server socket? ie. new session?
-                if readysock == self.sock:
+                if selkey.data is None:
                     log.debug("Data ready on our main socket")
                     buffer, (raddress, rport) = self.sock.recvfrom(MAX_BLKSIZE)
 
@@ -169,7 +177,7 @@ class TftpServer(TftpSession):
                         log.debug(
                             "Creating new server context for session key = %s" % key
                         )
-                        self.sessions[key] = TftpContextServer(
+                        session = TftpContextServer(
                             raddress,
                             rport,
                             timeout,
@@ -178,65 +186,82 @@ class TftpServer(TftpSession):
                             self.upload_open,
                             retries=retries,
                         )
+                        self.sessions[key] = session
+                        self.selector.register(session.sock, selectors.EVENT_READ, key)
                         try:
-                            self.sessions[key].start(buffer)
+                            session.start(buffer)
                         except TftpTimeoutExpectACK:
-                            self.sessions[key].timeout_expectACK = True
+                            session.timeout_expectACK = True
                         except TftpException as err:
                             deletion_list.append(key)
                             log.error(
                                 "Fatal exception thrown from session %s: %s"
                                 % (key, str(err))
                             )
+                        self._schedule_timeout(key, session)
                     else:
                         log.warning(
                             "received traffic on main socket for existing session??"
                         )
-                    log.info("Currently handling these sessions:")
-                    for session_key, session in list(self.sessions.items()):
-                        log.info("    %s" % session)
+                    log.info("Currently handling %d sessions" % len(self.sessions))
 
                 else:
-                    # Must find the owner of this traffic.
-                    for key in self.sessions:
-                        if readysock == self.sessions[key].sock:
-                            log.debug("Matched input to session key %s" % key)
-                            self.sessions[key].timeout_expectACK = False
-                            try:
-                                self.sessions[key].cycle()
-                                if self.sessions[key].state is None:
-                                    log.info("Successful transfer.")
-                                    deletion_list.append(key)
-                            except TftpTimeoutExpectACK:
-                                self.sessions[key].timeout_expectACK = True
-                            except TftpException as err:
-                                deletion_list.append(key)
-                                log.error(
-                                    "Fatal exception thrown from session %s: %s"
-                                    % (key, str(err))
-                                )
-                            # Break out of for loop since we found the correct
-                            # session.
-                            break
-                    else:
+                    key = selkey.data
+                    session = self.sessions.get(key)
+                    if session is None:
                         log.error("Can't find the owner for this packet. Discarding.")
+                        continue
+
+                    log.debug("Matched input to session key %s" % key)
+                    session.timeout_expectACK = False
+                    try:
+                        session.cycle()
+                        if session.state is None:
+                            log.info("Successful transfer.")
+                            deletion_list.append(key)
+                    except TftpTimeoutExpectACK:
+                        session.timeout_expectACK = True
+                        self._schedule_timeout(key, session)
+                    except TftpException as err:
+                        deletion_list.append(key)
+                        log.error(
+                            "Fatal exception thrown from session %s: %s"
+                            % (key, str(err))
+                        )
 
-            log.debug("Looping on all sessions to check for timeouts")
+            log.debug("Checking sessions that are due for a timeout")
             now = time.time()
-            for key in self.sessions:
+            # Entries are pushed after the loop, so one that is due again
+            # right away can not keep the loop spinning.
+            rescheduled = []
+            while self.timeouts and self.timeouts[0][0] <= now:
+                deadline, _, key, session = heapq.heappop(self.timeouts)
+                if self.sessions.get(key) is not session or key in deletion_list:
+                    continue
+                # Only the latest entry of a session counts, older ones were replaced.
+                if deadline != session.timeout_deadline:
+                    continue
+
                 try:
-                    self.sessions[key].checkTimeout(now)
+                    session.checkTimeout(now)
+                    # There was traffic since this entry was scheduled.
+                    rescheduled.append((key, session, None))
                 except TftpTimeout as err:
                     log.error(str(err))
-                    self.sessions[key].retry_count += 1
-                    if self.sessions[key].retry_count >= self.sessions[key].retries:
+                    session.retry_count += 1
+                    if session.retry_count >= session.retries:
                         log.debug(
-                            "hit max retries on %s, giving up" % self.sessions[key]
+                            "hit max retries on %s, giving up" % session
                         )
                         deletion_list.append(key)
                     else:
-                        log.debug("resending on session %s" % self.sessions[key])
-                        self.sessions[key].state.resendLast()
+                        log.debug("resending on session %s" % session)
+                        session.timeout_expectACK = False
+                        session.state.resendLast()
+                        rescheduled.append((key, session, now + timeout))
+
+            for key, session, deadline in rescheduled:
+                self._schedule_timeout(key, session, deadline)
 
             log.debug("Iterating deletion list.")
             for key in deletion_list:
@@ -244,6 +269,7 @@ class TftpServer(TftpSession):
                 log.info("Session %s complete" % key)
                 if key in self.sessions:
                     log.debug("Gathering up metrics from session before deleting")
+                    self.selector.unregister(self.sessions[key].sock)
                     self.sessions[key].end()
                     metrics = self.sessions[key].metrics
                     if metrics.duration == 0:
@@ -267,6 +293,18 @@ class TftpServer(TftpSession):
         log.debug("server returning from while loop")
         self.shutdown_gracefully = self.shutdown_immediately = False
 
+    def _schedule_timeout(self, key, session, deadline=None):
+        """Queue the next timeout check of a session. Sessions waiting for an
+        ACK are checked right away. A session has a single pending check, the
+        one matching its timeout_deadline; earlier entries are skipped."""
+        if deadline is None:
+            if session.timeout_expectACK:
+                deadline = time.time()
+            else:
+                deadline = session.last_update + session.timeout
+        session.timeout_deadline = deadline
+        heapq.heappush(self.timeouts, (deadline, next(self.timeout_seq), key, session))
+
     def stop(self, now=False):
         """Stop the server gracefully. Do not take any new transfers,
         but complete the existing ones. If force is True, drop everything
@@ -5,6 +5,9 @@
 MIN_BLKSIZE = 8
 DEF_BLKSIZE = 512
 MAX_BLKSIZE = 65536
+MIN_WINDOWSIZE = 1
+DEF_WINDOWSIZE = 1
+MAX_WINDOWSIZE = 64
 SOCK_TIMEOUT = 5
 MAX_DUPS = 20
 DEF_TIMEOUT_RETRIES = 3
@@ -13,6 +13,7 @@ error, in which case a TftpException is returned instead."""
 import logging
 import os
 import random
+import struct
 import time
 
 from .TftpPacketTypes import *
@@ -81,6 +82,22 @@ class TftpState:
             elif option == "tsize":
                 log.debug("tsize option is set")
                 accepted_options["tsize"] = 0
+            elif option == "windowsize":
+                size = int(options[option])
+                if size > MAX_WINDOWSIZE:
+                    log.info(
+                        "Client requested windowsize greater than %d "
+                        "setting to maximum" % MAX_WINDOWSIZE
+                    )
+                    accepted_options[option] = MAX_WINDOWSIZE
+                elif size < MIN_WINDOWSIZE:
+                    log.info(
+                        "Client requested windowsize less than %d "
+                        "setting to minimum" % MIN_WINDOWSIZE
+                    )
+                    accepted_options[option] = MIN_WINDOWSIZE
+                else:
+                    accepted_options[option] = size
             else:
                 log.info("Dropping unsupported option '%s'" % option)
         log.debug("Returning these accepted options: %s", accepted_options)
@@ -98,29 +115,58 @@ class TftpState:
             time.sleep(10)
         dat = None
         blksize = self.context.getBlocksize()
-        buffer = self.context.fileobj.read(blksize)
-        log.debug("Read %d bytes into buffer", len(buffer))
-        if len(buffer) < blksize:
+        # The block is read straight behind the header in a buffer that is
+        # reused for the whole transfer, so the packet is sent without
+        # copying. Every block of the window has its own slot, so the data
+        # stays valid until the block is acknowledged.
+        windowsize = self.context.getWindowsize()
+        if self.context.dat_buffer is None or len(self.context.dat_buffer) != windowsize * (blksize + 4):
+            self.context.dat_buffer = memoryview(bytearray(windowsize * (blksize + 4)))
+            self.context.dat_slot = 0
+        start = self.context.dat_slot * (blksize + 4)
+        buffer = self.context.dat_buffer[start:start + blksize + 4]
+        self.context.dat_slot = (self.context.dat_slot + 1) % windowsize
+        struct.pack_into("!HH", buffer, 0, 3, blocknumber)
+        if hasattr(self.context.fileobj, "readinto"):
+            size = self.context.fileobj.readinto(buffer[4:])
+        else:
+            data = self.context.fileobj.read(blksize)
+            if isinstance(data, str):
+                data = data.encode("ascii")
+            size = len(data)
+            buffer[4:4 + size] = data
+        log.debug("Read %d bytes into buffer", size)
+        if size < blksize:
             log.info("Reached EOF on file %s" % self.context.file_to_transfer)
             finished = True
         dat = TftpPacketDAT()
-        dat.data = buffer
+        dat.data = buffer[4:4 + size]
+        dat.buffer = buffer[:4 + size]
         dat.blocknumber = blocknumber
-        self.context.metrics.bytes += len(dat.data)
+        self.context.metrics.bytes += size
         # Testing hook
         if NETWORK_UNRELIABILITY > 0 and random.randrange(NETWORK_UNRELIABILITY) == 0:
             log.warning("Skipping DAT packet %d for testing", dat.blocknumber)
         else:
             log.debug("Sending DAT packet %d", dat.blocknumber)
             self.context.sock.sendto(
-                dat.encode().buffer, (self.context.host, self.context.tidport)
+                dat.buffer, (self.context.host, self.context.tidport)
             )
             self.context.metrics.last_dat_time = time.time()
         if self.context.packethook:
             self.context.packethook(dat)
         self.context.last_pkt = dat
+        self.context.window.append(dat)
         return finished
 
+    def sendWindow(self):
+        """This method sends DAT packets after the last one sent until the
+        window is full or the file is exhausted."""
+        windowsize = self.context.getWindowsize()
+        while len(self.context.window) < windowsize and not self.context.pending_complete:
+            self.context.next_block += 1
+            self.context.pending_complete = self.sendDAT()
+
     def sendACK(self, blocknumber=None):
         """This method sends an ack packet to the block number specified. If
         none is specified, it defaults to the next_block property in the
@@ -166,22 +212,28 @@ class TftpState:
         self.context.last_pkt = pkt
 
     def resendLast(self):
-        """Resend the last sent packet due to a timeout."""
+        """Resend the last sent packet due to a timeout. If it is a DAT
+        packet, the whole unacknowledged window is resent."""
         assert( self.context.last_pkt is not None )
-        log.warning(f"Resending packet {self.context.last_pkt} on sessions {self}")
-        self.context.metrics.resent_bytes += len(self.context.last_pkt.buffer)
-        self.context.metrics.add_dup(self.context.last_pkt)
+        packets = [self.context.last_pkt]
+        if isinstance(self.context.last_pkt, TftpPacketDAT) and self.context.window:
+            packets = self.context.window
         sendto_port = self.context.tidport
         if not sendto_port:
             # If the tidport wasn't set, then the remote end hasn't even
             # started talking to us yet. That's not good. Maybe it's not
             # there.
             sendto_port = self.context.port
-        self.context.sock.sendto(
-            self.context.last_pkt.encode().buffer, (self.context.host, sendto_port)
-        )
-        if self.context.packethook:
-            self.context.packethook(self.context.last_pkt)
+        for pkt in packets:
+            log.warning(f"Resending packet {pkt} on sessions {self}")
+            buffer = pkt.encode().buffer
+            self.context.metrics.resent_bytes += len(buffer)
+            self.context.metrics.add_dup(pkt)
+            self.context.sock.sendto(
+                buffer, (self.context.host, sendto_port)
+            )
+            if self.context.packethook:
+                self.context.packethook(pkt)
 
     def handleDat(self, pkt):
         """This method handles a DAT packet during a client download, or a
@@ -191,14 +243,20 @@ class TftpState:
         if pkt.blocknumber == self.context.next_block:
             log.debug("Good, received block %d in sequence", pkt.blocknumber)
 
-            self.sendACK()
+            # Only the last block of a window is acknowledged.
+            self.context.window_received += 1
+            self.context.window_gap = False
+            last = len(pkt.data) < self.context.getBlocksize()
+            if last or self.context.window_received >= self.context.getWindowsize():
+                self.sendACK()
+                self.context.window_received = 0
             self.context.next_block += 1
 
             log.debug("Writing %d bytes to output file", len(pkt.data))
             self.context.fileobj.write(pkt.data)
             self.context.metrics.bytes += len(pkt.data)
             # Check for end-of-file, any less than full data packet.
-            if len(pkt.data) < self.context.getBlocksize():
+            if last:
                 log.info("End of file detected")
                 return None
 
@@ -209,8 +267,24 @@ class TftpState:
                 raise TftpException("There is no block zero!")
             log.warning("Dropping duplicate block %d" % pkt.blocknumber)
             self.context.metrics.add_dup(pkt)
-            log.debug("ACKing block %d again, just in case", pkt.blocknumber)
-            self.sendACK(pkt.blocknumber)
+            if self.context.getWindowsize() > 1:
+                # Tell the sender where to restart the window.
+                log.debug("ACKing last block in sequence")
+                self.sendACK((self.context.next_block - 1) % 2 ** 16)
+                self.context.window_received = 0
+            else:
+                log.debug("ACKing block %d again, just in case", pkt.blocknumber)
+                self.sendACK(pkt.blocknumber)
+
+        elif self.context.getWindowsize() > 1:
+            # A block of the window got lost. Acknowledge the last block
+            # received in sequence once, the sender restarts from there.
+            log.warning("Received future block %d but expected %d, dropping"
+                % (pkt.blocknumber, self.context.next_block))
+            if not self.context.window_gap:
+                self.sendACK((self.context.next_block - 1) % 2 ** 16)
+                self.context.window_received = 0
+                self.context.window_gap = True
 
         else:
             # FIXME: should we be more tolerant and just discard instead?
@@ -320,20 +394,19 @@ class TftpStateServerRecvRRQ(TftpServerState):
         sendoack = self.serverInitial(pkt, raddress, rport)
         path = self.full_path
         log.info("Opening file %s for reading" % path)
-        if os.path.exists(path):
-            # Note: Open in binary mode for win32 portability, since win32
-            # blows.
-            self.context.fileobj = open(path, "rb")
-        elif self.context.dyn_file_func:
-            log.debug("No such file %s but using dyn_file_func", path)
+        # Files provided by dyn_file_func take precedence over the ones on
+        # disk, so generated files are never read back from the file system.
+        if self.context.dyn_file_func:
+            log.debug("Trying dyn_file_func for %s", path)
             self.context.fileobj = self.context.dyn_file_func(
                 self.context.file_to_transfer, raddress=raddress, rport=rport
             )
-
-            if self.context.fileobj is None:
-                log.debug("dyn_file_func returned 'None', treating as " "FileNotFound")
-                self.sendError(TftpErrors.FileNotFound)
-                raise TftpException("File not found: %s" % path)
+        if self.context.fileobj is not None:
+            log.debug("Serving %s from dyn_file_func", path)
+        elif os.path.exists(path):
+            # Note: Open in binary mode for win32 portability, since win32
+            # blows.
+            self.context.fileobj = open(path, "rb")
         else:
             log.warning("File not found: %s", path)
             self.sendError(TftpErrors.FileNotFound)
@@ -359,6 +432,7 @@ class TftpStateServerRecvRRQ(TftpServerState):
             self.context.next_block = 1
             log.debug("No requested options, starting send...")
             self.context.pending_complete = self.sendDAT()
+            self.sendWindow()
         # Note, we expect an ack regardless of whether we sent a DAT or an
         # OACK.
         return TftpStateExpectACK(self.context)
@@ -463,18 +537,34 @@ class TftpStateExpectACK(TftpState):
         """Handle a packet, hopefully an ACK since we just sent a DAT."""
         if isinstance(pkt, TftpPacketACK):
             log.debug("Received ACK for packet %d" % pkt.blocknumber)
+            # How many blocks were sent after the acknowledged one. Block
+            # numbers roll over, so this is computed modulo 2 ** 16.
+            ahead = (self.context.next_block - pkt.blocknumber) % 2 ** 16
             # Is this an ack to the one we just sent?
-            if self.context.next_block == pkt.blocknumber:
+            if ahead == 0:
                 if self.context.pending_complete:
                     log.info("Received ACK to final DAT, we're done.")
                     return None
                 else:
-                    log.debug("Good ACK, sending next DAT")
-                    self.context.next_block += 1
+                    log.debug("Good ACK, sending next window")
+                    self.context.window.clear()
+                    self.sendWindow()
                     log.debug("Incremented next_block to %d", self.context.next_block)
-                    self.context.pending_complete = self.sendDAT()
 
-            elif pkt.blocknumber < self.context.next_block:
+            elif ahead < len(self.context.window):
+                # Part of the window got lost, resend it from the block after
+                # the acknowledged one and fill the rest of the window.
+                log.warning("Received ACK for block %d in the middle of the window" % pkt.blocknumber)
+                del self.context.window[:-ahead]
+                for dat in self.context.window:
+                    self.context.metrics.resent_bytes += len(dat.buffer)
+                    self.context.sock.sendto(
+                        dat.buffer, (self.context.host, self.context.tidport)
+                    )
+                self.context.metrics.last_dat_time = time.time()
+                self.sendWindow()
+
+            elif ahead < 2 ** 15:
                 log.warning("Received duplicate ACK for block %d" % pkt.blocknumber)
                 self.context.metrics.add_dup(pkt)
                 if self.context.metrics.last_dat_time > 0:
@@ -545,6 +635,7 @@ class TftpStateSentWRQ(TftpState):
             else:
                 log.debug("Sending first DAT packet")
                 self.context.pending_complete = self.sendDAT()
+                self.sendWindow()
                 log.debug("Changing state to TftpStateExpectACK")
                 return TftpStateExpectACK(self.context)
 
@@ -554,6 +645,7 @@ class TftpStateSentWRQ(TftpState):
             # The block number should be zero.
             if pkt.blocknumber == 0:
                 log.debug("Ack blocknumber is zero as expected")
+                self.context.options = {"blksize": DEF_BLKSIZE}
                 log.debug("Sending first DAT packet")
                 self.context.pending_complete = self.sendDAT()
                 log.debug("Changing state to TftpStateExpectACK")
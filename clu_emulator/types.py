@@ -5,6 +5,12 @@ from enum import Enum
 class CommunicationType(Enum):
     LOCAL = "local"
     CLOUD = "cloud"
+    
+class PacketType(Enum):
+    PROJECT = "project"
+    DISCOVERY = "discovery"
+    PRIVATE = "private"
+    UNKNOWN = "unknown"
 
 @dataclass
 class RequestContext: